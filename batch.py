@@ -0,0 +1,92 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from cache import Cache
+from compiler import add_common_arguments, compile_cached
+
+cache = None    # of worker process
+
+
+def start_worker(use_cache, cache_dir):
+    global cache
+    if use_cache:
+        cache = Cache() if cache_dir is None else Cache(cache_dir)
+
+
+# compiles single program in worker process, every one with fresh generator (parser tables are built once per worker)
+def compile_unit(input_program, out_compiled_program, disabled):
+    start = time.perf_counter()
+    try:
+        with open(input_program, 'r') as input_file:
+            source_code = input_file.read()
+        (code, diagnostics, error) = compile_cached(source_code, disabled, cache)
+        with open(out_compiled_program, 'w') as output_file:
+            if not error:
+                output_file.write(code)
+        status = 'error' if error else 'ok'
+    except Exception as e:
+        (diagnostics, status) = (f'Error: {e}\n', 'failed')
+    return (input_program, out_compiled_program, status, time.perf_counter() - start, diagnostics)
+
+
+# (input, output) pairs from manifest: one pair per line separated by whitespace, '#' starts comment,
+# relative paths are relative to manifest
+def read_manifest(path):
+    directory = os.path.dirname(os.path.abspath(path))
+    pairs = []
+    with open(path, 'r') as manifest_file:
+        for number, line in enumerate(manifest_file, 1):
+            fields = line.split('#', 1)[0].split()
+            if len(fields) == 0:
+                continue
+            if len(fields) != 2:
+                raise Exception(f'{path}: line {number}: expected <input_program> <out_compiled_program>')
+            pairs.append(tuple(os.path.normpath(os.path.join(directory, field)) for field in fields))
+    return pairs
+
+
+def available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+if __name__ == '__main__':
+    arguments = argparse.ArgumentParser(usage='python batch.py [<input_program> <out_compiled_program> ...] [--manifest <file>]',
+                                        description='compile many programs at once in a pool of worker processes')
+    arguments.add_argument('programs', nargs='*', help='pairs of input program and output file')
+    arguments.add_argument('--manifest', action='append', default=[], help='file with pair of input program and output file in every line')
+    arguments.add_argument('--jobs', type=int, default=available_cores(), help='number of worker processes (default: available cores)')
+    add_common_arguments(arguments)
+    arguments.add_argument('--quiet', action='store_true', help='print diagnostics and status only of programs that failed')
+    options = arguments.parse_args()
+
+    if len(options.programs) % 2 != 0:
+        arguments.error('programs have to be given in pairs: <input_program> <out_compiled_program>')
+    pairs = list(zip(options.programs[::2], options.programs[1::2]))
+    try:
+        for manifest in options.manifest:
+            pairs.extend(read_manifest(manifest))
+    except Exception as e:
+        print(f'Error: {e}', file=sys.stderr)
+        exit(2)
+
+    start = time.perf_counter()
+    failed = 0
+    with ProcessPoolExecutor(max_workers=max(1, options.jobs), initializer=start_worker,
+                             initargs=(not options.no_cache, options.cache_dir)) as pool:
+        results = pool.map(compile_unit, [pair[0] for pair in pairs], [pair[1] for pair in pairs], [options.disable] * len(pairs))
+        for (input_program, out_compiled_program, status, seconds, diagnostics) in results:
+            if status != 'ok':
+                failed += 1
+            elif options.quiet:
+                continue
+            print(f'{status:<6} {seconds:8.3f}s  {input_program} -> {out_compiled_program}')
+            for line in diagnostics.splitlines():
+                print(f'         {line}')
+
+    print(f'{len(pairs)} program(s), {failed} failed, {time.perf_counter() - start:.3f}s')
+    exit(1 if failed else 0)
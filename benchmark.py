@@ -0,0 +1,160 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import batch
+from compiler import compile_source
+import vm
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+CORPORA = ['testy', 'my_tests']
+INPUTS = os.path.join(ROOT, 'benchmarks', 'inputs.json')
+BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+TIMES = os.path.join(ROOT, 'benchmarks', 'compile_times.json')   # recorded for comparison only, never fails the suite
+COST_LIMIT = 10 ** 10   # protects the suite against programs that never halt
+
+
+def find_programs():
+    programs = []
+    for corpus in CORPORA:
+        for name in sorted(os.listdir(os.path.join(ROOT, corpus))):
+            if name.endswith('.imp'):
+                programs.append(f'{corpus}/{name}')
+    return programs
+
+
+def measure(program, vectors):
+    with open(os.path.join(ROOT, program), 'r') as input_file:
+        source_code = input_file.read()
+
+    diagnostics = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(diagnostics):
+        code_generator = compile_source(source_code)
+    compile_time = time.perf_counter() - start
+
+    if code_generator.errorMode or len(code_generator.code) == 0:
+        return program, {'status': 'error', 'compile_time': round(compile_time, 6)}
+
+    runs = []
+    for vector in vectors:
+        try:
+            result = vm.run(code_generator.code, vector, limit=COST_LIMIT)
+            runs.append({'input': vector, 'output': result.outputs, 'cost': result.cost, 'io': result.io})
+        except Exception as e:
+            runs.append({'input': vector, 'error': str(e)})
+
+    return program, {
+        'status': 'ok',
+        'instructions': len(code_generator.code),
+        'compile_time': round(compile_time, 6),
+        'runs': runs,
+    }
+
+
+# programs that don't compile have to be reported as failed by batch compilation too - compiled and then served
+# from (empty at first) cache
+def check_batch(programs):
+    failures = []
+    with tempfile.TemporaryDirectory() as directory:
+        batch.start_worker(True, os.path.join(directory, 'cache'))
+        for program in programs:
+            for attempt in ('compiled', 'cached'):
+                (_, _, status, _, _) = batch.compile_unit(os.path.join(ROOT, program), os.path.join(directory, 'out.mr'), ())
+                if status != 'error':
+                    failures.append(f"{program}: batch compilation ({attempt}) reports '{status}' instead of 'error'")
+    return failures
+
+
+def compile_time(program, entry, times):
+    recorded = f' (recorded {times[program] * 1000:.1f} ms)' if program in times else ''
+    return f'compile {entry["compile_time"] * 1000:.1f} ms{recorded}'
+
+
+# times: program -> compile time recorded with last update of baseline, only printed next to current one
+def compare(baseline, current, threshold, times = {}):
+    failures = []
+    for program, entry in current.items():
+        old = baseline.get(program)
+        if old is None:
+            print(f'  {program}: new program (not in baseline), {compile_time(program, entry, times)}')
+            continue
+        if old['status'] != entry['status']:
+            failures.append(f"{program}: status changed from '{old['status']}' to '{entry['status']}'")
+            continue
+        if entry['status'] != 'ok':
+            print(f'  {program}: {entry["status"]}, {compile_time(program, entry, times)}')
+            continue
+
+        print(f'  {program}: {compile_time(program, entry, times)}')
+
+        if len(old['runs']) != len(entry['runs']):
+            failures.append(f"{program}: {len(entry['runs'])} input vector(s), baseline has {len(old['runs'])}")
+            continue
+        for old_run, run in zip(old['runs'], entry['runs']):
+            label = f'{program} {run["input"]}'
+            if 'error' in run:
+                failures.append(f'{label}: {run["error"]}')
+                continue
+            if 'error' in old_run:
+                print(f'  {label}: fixed ({old_run["error"]})')
+                continue
+            if run['output'] != old_run['output']:
+                failures.append(f'{label}: output changed from {old_run["output"]} to {run["output"]}')
+                continue
+            change = (run['cost'] - old_run['cost']) / old_run['cost'] * 100 if old_run['cost'] else 0.0
+            print(f'  {label}: cost {old_run["cost"]} -> {run["cost"]} ({change:+.2f}%), instructions {old["instructions"]} -> {entry["instructions"]}')
+            if change > threshold:
+                failures.append(f'{label}: cost grew by {change:.2f}% (threshold: {threshold}%)')
+    return failures
+
+
+if __name__ == '__main__':
+    arguments = argparse.ArgumentParser(description='compile and run every program of testy/ and my_tests/, compare cost against baseline')
+    arguments.add_argument('--threshold', type=float, default=0.0, help='allowed cost growth in percent (default: 0)')
+    arguments.add_argument('--jobs', type=int, default=os.cpu_count(), help='number of worker processes')
+    arguments.add_argument('--baseline', default=BASELINE, help='baseline file')
+    arguments.add_argument('--times', default=TIMES, help='file with compile times (printed for comparison, never fail the suite)')
+    arguments.add_argument('--update', action='store_true', help='overwrite baseline and compile times with current results')
+    options = arguments.parse_args()
+
+    with open(INPUTS, 'r') as inputs_file:
+        inputs = json.load(inputs_file)
+
+    programs = find_programs()
+    with ProcessPoolExecutor(max_workers=options.jobs) as pool:
+        results = pool.map(measure, programs, [inputs.get(program, [[]]) for program in programs])
+        current = dict(results)
+
+    if options.update or not os.path.exists(options.baseline):
+        # compile time depends on machine and load, it is kept apart from cost and output in baseline
+        stored = {program: {key: value for key, value in entry.items() if key != 'compile_time'} for program, entry in current.items()}
+        with open(options.baseline, 'w') as baseline_file:
+            json.dump(stored, baseline_file, indent=4, ensure_ascii=False)
+            baseline_file.write('\n')
+        with open(options.times, 'w') as times_file:
+            json.dump({program: entry['compile_time'] for program, entry in current.items()}, times_file, indent=4, ensure_ascii=False)
+            times_file.write('\n')
+        print(f'Baseline written to {options.baseline}, compile times to {options.times}')
+        exit(0)
+
+    with open(options.baseline, 'r') as baseline_file:
+        baseline = json.load(baseline_file)
+    times = dict()
+    if os.path.exists(options.times):
+        with open(options.times, 'r') as times_file:
+            times = json.load(times_file)
+
+    failures = compare(baseline, current, options.threshold, times)
+    total = sum(entry['compile_time'] for entry in current.values())
+    recorded = sum(times[program] for program in current if program in times)
+    print(f'Compile time: {total:.3f}s' + (f' (recorded {recorded:.3f}s)' if times else ''))
+    failures += check_batch([program for program, entry in current.items() if entry['status'] == 'error'])
+    for failure in failures:
+        print(f'Error: {failure}')
+    exit(1 if failures else 0)
@@ -0,0 +1,103 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+# modules whose code decides what compiler produces - any change of them is new version of compiler
+SOURCES = ('compiler.py', 'lexer.py', 'parser.py', 'generator.py', 'instructions.py', 'linker.py', 'peephole.py',
+           'tracking.py', 'propagation.py')
+FORMAT = 1  # layout of cache entry
+
+DIRECTORY = os.environ.get('COMPILER_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'compiler'))
+MAX_SIZE = 64 * 1024 * 1024     # bytes of all entries
+MAX_AGE = 30 * 24 * 60 * 60     # seconds since entry was last used
+
+
+def compiler_version():
+    digest = hashlib.sha256()
+    for name in SOURCES:
+        with open(os.path.join(ROOT, name), 'rb') as source_file:
+            digest.update(source_file.read())
+    return digest.hexdigest()
+
+
+# content addressed cache of compiled programs: entry (code in text form, diagnostics printed by compiler and
+# whether compilation failed) is file named by sha256 of source, version of compiler and turned off optimizations.
+# Entries are written to temporary file and renamed into place, so parallel compilers never read half written one -
+# at worst both of them compile the same program and the last rename wins. Least recently used entries are evicted
+# when cache grows over max_size, and every entry unused for max_age seconds
+class Cache:
+    def __init__(self, directory = DIRECTORY, max_size = MAX_SIZE, max_age = MAX_AGE):
+        self.directory = directory
+        self.max_size = max_size
+        self.max_age = max_age
+        self.version = compiler_version()
+
+    def key(self, source_code, disabled = ()):
+        digest = hashlib.sha256()
+        digest.update(f'{FORMAT}\0{self.version}\0{",".join(sorted(set(disabled)))}\0'.encode())
+        digest.update(source_code.encode())
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, f'{key}.json')
+
+    # entry or None when there is none (or it can't be read)
+    def get(self, key):
+        try:
+            with open(self.path(key), 'r') as entry_file:
+                entry = json.load(entry_file)
+        except (OSError, ValueError):
+            return None
+        try:
+            os.utime(self.path(key))   # modification time is time of last use
+        except OSError:
+            pass    # entry evicted by other compiler in the meantime (or read only cache) is still good
+        return entry
+
+    def put(self, key, entry):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            (descriptor, temporary) = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            try:
+                with os.fdopen(descriptor, 'w') as entry_file:
+                    json.dump(entry, entry_file)
+                os.replace(temporary, self.path(key))
+            except BaseException:
+                os.remove(temporary)
+                raise
+            self.evict()
+        except OSError:
+            pass    # compilation doesn't fail because its result can't be cached
+
+    def evict(self):
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                status = os.stat(path)
+            except OSError:
+                continue    # removed by other compiler in the meantime
+            # temporary file that lived that long was left by compiler that didn't finish
+            limit = self.max_age if name.endswith('.json') else 60 * 60
+            if now - status.st_mtime > limit:
+                remove(path)
+            elif name.endswith('.json'):
+                entries.append((status.st_mtime, status.st_size, path))
+
+        size = sum(entry[1] for entry in entries)
+        for (_, entry_size, path) in sorted(entries):
+            if size <= self.max_size:
+                break
+            remove(path)
+            size -= entry_size
+
+
+def remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -1,20 +1,88 @@
+import argparse
+import contextlib
+import io
 import sys
-from lexer import MyLexer
-from parser import MyParser
+from cache import Cache
+from generator import Generator, OPTIMIZATIONS
+from instructions import to_text
+import vm
+
+def compile_source(source_code, disabled = ()):
+    # imported only when something is compiled - building tables of parser is skipped when cache has the program
+    from lexer import MyLexer
+    from parser import MyParser
+    lexer  = MyLexer()
+    parser = MyParser(Generator(disabled))
+    parser.parse(lexer.tokenize(source_code))
+    if lexer.failed:
+        parser.code_generator.errorMode = True
+    return parser.code_generator
+
+# (code in text form, diagnostics, True when compilation failed) - from cache when source was already compiled
+def compile_cached(source_code, disabled = (), cache = None):
+    entry = None
+    if cache is not None:
+        key = cache.key(source_code, disabled)
+        entry = cache.get(key)
+    if entry is None:
+        diagnostics = io.StringIO()
+        with contextlib.redirect_stdout(diagnostics):
+            code_generator = compile_source(source_code, disabled)
+        # program without code didn't compile, even when no error was reported - it isn't cached as compiled one
+        error = code_generator.errorMode or len(code_generator.code) == 0
+        entry = {'code': '' if error else to_text(code_generator.code),
+                 'diagnostics': diagnostics.getvalue(), 'error': error}
+        if cache is not None:
+            cache.put(key, entry)
+    return (entry['code'], entry['diagnostics'], entry['error'])
+
+# options of every command line tool that compiles programs (compiler.py, batch.py)
+def add_common_arguments(arguments):
+    arguments.add_argument('--disable', action='append', default=[], choices=OPTIMIZATIONS, metavar='OPTIMIZATION', help=f'turn off optimization, one of: {", ".join(OPTIMIZATIONS)}')
+    arguments.add_argument('--no-cache', action='store_true', help='always compile, without reading or writing compilation cache')
+    arguments.add_argument('--cache-dir', default=None, help='directory of compilation cache (default: $COMPILER_CACHE or ~/.cache/compiler)')
 
 if __name__ == '__main__':
-    if len(sys.argv) < 3:
+    arguments = argparse.ArgumentParser(usage='python compiler.py <input_program> <out_compiled_program> [--run]')
+    arguments.add_argument('input_program')
+    arguments.add_argument('out_compiled_program', nargs='?')
+    arguments.add_argument('--run', action='store_true', help='execute compiled program on built-in virtual machine (input is read from stdin)')
+    add_common_arguments(arguments)
+    arguments.add_argument('--stats', action='store_true', help='print what every rule of peephole optimizer saved')
+    options = arguments.parse_args()
+
+    if options.out_compiled_program is None and not options.run:
         print(f'Usage: python <input_program> <out_compiled_program>')
         exit(1)
 
-    with open(sys.argv[1], 'r') as input_file:
+    with open(options.input_program, 'r') as input_file:
         source_code = input_file.read()
 
-        lexer  = MyLexer()
-        parser = MyParser()
-        parser.parse(lexer.tokenize(source_code))
-        
-        with open(sys.argv[2], 'w') as output_file:
-            if not parser.code_generator.errorMode:
-                for line in parser.code_generator.code:
-                    output_file.write(line + '\n')
\ No newline at end of file
+        if options.stats:
+            # statistics come from generator itself, so there is nothing to take from cache
+            code_generator = compile_source(source_code, options.disable)
+            (code, error) = (to_text(code_generator.code), code_generator.errorMode)
+        else:
+            cache = None
+            if not options.no_cache:
+                cache = Cache() if options.cache_dir is None else Cache(options.cache_dir)
+            (code, diagnostics, error) = compile_cached(source_code, options.disable, cache)
+            print(diagnostics, end='')
+
+        if options.out_compiled_program is not None:
+            with open(options.out_compiled_program, 'w') as output_file:
+                if not error:
+                    output_file.write(code)
+
+        if options.stats:
+            print(code_generator.statistics)
+
+    if options.run:
+        if error:
+            exit(1)
+        try:
+            result = vm.run(code, vm.read_numbers(sys.stdin), write=lambda value: print(f'> {value}'))
+        except Exception as e:
+            print(f'Error: {e}', file=sys.stderr)
+            exit(1)
+        print(f'Finished program (cost: {result.cost}; i/o: {result.io})')
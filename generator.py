@@ -1,3 +1,11 @@
+import contextlib
+import io
+from instructions import Instruction, Label
+from peephole import RULES, Statistics, optimize
+from tracking import track_values, remove_dead_stores
+from linker import assemble, link
+from propagation import fold, compare, value_of, transfer, loop_head
+
 class Variable:
     def __init__(self, location):
         self.location = location
@@ -19,14 +27,19 @@ class Array:
 
     def get(self, index):
         if self.lower_bound <= index <= self.upper_bound:
-            return self.location + (index - self.lower_bound) + 1   # + 1 because first cell stores lower bound value
+            return self.base() + index
         else:
             raise Exception(f"Index '{index}' is out of bounds for array '{self.name}'")
+
+    # address of element 0 (it may lie outside of array) - index is added to it at runtime
+    def base(self):
+        return self.location - self.lower_bound
         
 class Pointer:
     def __init__(self, location, type):
         self.location = location
         self.type = type
+        self.array = None   # name of array when pointer is induction variable walking through its elements
 
     def __repr__(self):
         return f'Type: {self.type}, Location: {self.location}'
@@ -42,7 +55,7 @@ class Iterator:
 TEMP_CELL_A = 0
 TEMP_CELL_B = 1     # gen_body
 
-TEMP_CELL_C = 2     # gen_condition
+TEMP_CELL_C = 2     # free
 TEMP_CELL_D = 3     # gen_condition
 
 TEMP_CELL_E = 4     # calculate_expression
@@ -54,21 +67,187 @@ TEMP_CELL_J = 9     # calculate_expression
 TEMP_CELL_K = 10    # calculate_expression
 TEMP_CELL_L = 11    # calculate_expression
 
-TEMP_CELL_M = 12    # for temporary address of variable in load_address function
-TEMP_CELL_V = 13    # for temporary address of variable in load_value function
-TEMP_CELL_V2= 14    # for temporary address of variable in load_value function
+TEMP_CELL_M = 12    # index of array element in element_address function
+TEMP_CELL_V = 13    # free
+TEMP_CELL_V2= 14    # free
+
+TEMP_CELL_R = 15    # return address of runtime routines
+ARGUMENTS = (TEMP_CELL_E, TEMP_CELL_F, TEMP_CELL_R)  # temporary cells read by runtime routine
+RESULTS = (TEMP_CELL_G, TEMP_CELL_H)                # temporary cells read after runtime routine returns
+
+FIRST_CELL = 16     # first cell of variables
+
+# constant pool cost model
+SET_COST = 50
+LOAD_COST = 10
+POOL_SETUP_COST = 60    # SET + STORE executed once at program start
+LOOP_WEIGHT = 10        # assumed number of executions of loop body per one execution of loop
+
+# strength reduction cost model - estimated cost of multiply routine (with constant as smaller factor)
+MULTIPLY_COST = 150
+MULTIPLY_STEP_COST = 120    # every bit of smaller factor
+NEGATION_COST = 30
+
+# runtime routines are inlined only in loops, as long as inlined code stays in budget
+INLINE_DEPTH = 1
+INLINE_BUDGET = 1000    # instructions
+
+# procedures are inlined when called from single place or small enough, as long as inlined code stays in budget
+PROCEDURE_INLINE_SIZE = 100     # instructions
+PROCEDURE_INLINE_BUDGET = 5000  # instructions
+
+
+# digits (1, 0, -1) of non adjacent form of positive number, most significant first:
+# chain doubles accumulator for each digit after the first one and adds/subtracts x for every non zero digit
+def signed_digits(number):
+    digits = []
+    while number > 0:
+        if number % 2 == 0:
+            digits.append(0)
+        else:
+            digit = 2 - number % 4
+            digits.append(digit)
+            number -= digit
+        number //= 2
+    return digits[::-1]
+
+
+def chain_cost(digits):
+    return LOAD_COST * (len(digits) - 1 + sum(1 for digit in digits[1:] if digit != 0))
+
+
+# conditional jumps taken when result of subtraction of compared values meets comparison,
+# comparison that is met when given one isn't, and the same comparison with values swapped
+BRANCHES = {'>': ('JPOS',), '<': ('JNEG',), '=': ('JZERO',), '>=': ('JPOS', 'JZERO'), '<=': ('JNEG', 'JZERO'), '!=': ('JPOS', 'JNEG')}
+COMPLEMENT = {'>': '<=', '<': '>=', '=': '!=', '>=': '<', '<=': '>', '!=': '='}
+MIRROR = {'>': '<', '<': '>', '=': '=', '>=': '<=', '<=': '>=', '!=': '!='}
+
+# optimizations that can be turned off with: compiler.py --disable <name>
+# (every rule of peephole optimizer separately as well)
+OPTIMIZATIONS = ('constant_pool', 'loop_rotation', 'peephole', 'value_tracking', 'runtime_routines',
+                 'common_subexpressions', 'constant_propagation', 'inlining', 'loop_invariants',
+                 'induction_variables', 'counted_loops', 'shared_storage') + tuple(RULES)
+
+
+# (array, literal index) of every array element with literal index used in commands
+def literal_indexes(commands):
+    for item in commands:
+        if isinstance(item, (tuple, list)):
+            if len(item) == 3 and item[0] == 'array' and item[2][0] == 'number':
+                yield (item[1], item[2][1])
+            else:
+                yield from literal_indexes(item)
+
+
+# elements of arrays indexed by variable (iterator) in commands, with number of executions per one execution of commands
+def indexed(commands, name, weight = 1):
+    for item in commands:
+        if isinstance(item, (tuple, list)):
+            if len(item) == 3 and item[0] == 'array' and item[2] == ('load', name):
+                yield (item, weight)
+            elif item and item[0] in ('while', 'repeat', 'for_to', 'for_downto'):
+                yield from indexed(item, name, weight * LOOP_WEIGHT)
+            else:
+                yield from indexed(item, name, weight)
+
+
+# True when value of variable (iterator) is read by commands
+def reads(commands, name):
+    for item in commands:
+        if isinstance(item, (tuple, list)) and item:
+            if item == ('load', name) or item == ('load', ('variable', name)) or item[0] == 'call' and name in item[1][1]:
+                return True
+            if reads(item, name):
+                return True
+    return False
+
+
+# names of procedures called by commands
+def called(commands):
+    names = set()
+    for item in commands:
+        if isinstance(item, (tuple, list)) and item:
+            if item[0] == 'call':
+                names.add(item[1][0])
+            else:
+                names |= called(item)
+    return names
+
+
+# names of variables and arrays written by commands (assignments, reads, arguments of calls, iterators)
+def written(commands):
+    names = set()
+    for command in commands:
+        if command[0] == 'assign' or command[0] == 'read':
+            names.add(command[1][1])
+        elif command[0] == 'call':
+            names.update(command[1][1])
+        elif command[0] == 'ifelse':
+            names |= written(command[2]) | written(command[3])
+        elif command[0] == 'while' or command[0] == 'repeat':
+            names |= written(command[2])
+        elif command[0] == 'for_to' or command[0] == 'for_downto':
+            names.add(command[1])
+            names |= written(command[4])
+    return names
+
+
+# commands with expressions (right hand sides of assignments), values and written identifiers mapped by functions
+def rewrite(commands, expression, value, identifier = lambda identifier: identifier):
+    def condition(comparison):
+        return ('comparison', comparison[1], value(comparison[2]), value(comparison[3]))
+
+    result = []
+    for command in commands:
+        if command[0] == 'assign':
+            command = ('assign', identifier(command[1]), ('exp', expression(command[2][1])), command[3])
+        elif command[0] == 'read':
+            command = ('read', identifier(command[1]), command[2])
+        elif command[0] == 'write':
+            command = ('write', value(command[1]), command[2])
+        elif command[0] == 'ifelse':
+            command = ('ifelse', condition(command[1]), rewrite(command[2], expression, value, identifier),
+                       rewrite(command[3], expression, value, identifier))
+        elif command[0] == 'while' or command[0] == 'repeat':
+            command = (command[0], condition(command[1]), rewrite(command[2], expression, value, identifier))
+        elif command[0] == 'for_to' or command[0] == 'for_downto':
+            command = (command[0], command[1], value(command[2]), value(command[3]),
+                       rewrite(command[4], expression, value, identifier), command[5])
+        result.append(command)
+    return result
 
 
 class Memory(dict):
-    def __init__(self, offset):
+    def __init__(self, offset, shared):
         super().__init__()
-        self.offset = offset
+        self.offset = offset    # next cell of declared variables, arrays and pointers - never shared with anything
+        self.shared = shared    # next cell of iterators and hidden variables - compiler writes them before every read
+        self.top = shared       # first shared cell after all shared cells that were ever allocated
+
+    # shared cells from offset on are free again - iterators and hidden variables of finished loop or inlined procedure
+    def release(self, offset):
+        self.top = max(self.top, self.shared)
+        self.shared = offset
+
+    def end(self):
+        return max(self.top, self.shared)
+
+    # hidden variables of finished block (their cells from offset on) are never used again
+    def drop_hidden(self, offset):
+        for name in [name for name, cell in self.items() if name.startswith('$') and cell.location >= offset]:
+            del self[name]
+
+    def allocate(self, size, shared):
+        if shared:
+            self.shared += size
+            return self.shared - size
+        self.offset += size
+        return self.offset - size
     
-    def add_variable(self, name):
+    def add_variable(self, name, shared = False):
         if name in self:
             raise Exception(f"variable '{name}' is already declared")
-        self.setdefault(name, Variable(self.offset))
-        self.offset += 1
+        self.setdefault(name, Variable(self.allocate(1, shared)))
 
     def add_array(self, name, lower_bound, upper_bound):
         size = upper_bound - lower_bound + 1
@@ -76,14 +255,12 @@ class Memory(dict):
             raise Exception(f"array '{name}' is already declared")
         elif size <= 0:
             raise Exception(f"array '{name}' can not be declared with lower bound: '{lower_bound}' greater that upper bound: '{upper_bound}' -> size; '{size}'")
-        self.setdefault(name, Array(name, self.offset, lower_bound, upper_bound))
-        self.offset += (size + 1)  # + 1 because we store lower bound as a first element of array (needed for proper index calculation)
+        self.setdefault(name, Array(name, self.allocate(size, False), lower_bound, upper_bound))
 
-    def add_pointer(self, name, type):
+    def add_pointer(self, name, type, shared = False):
         if name in self:
             raise Exception(f"pointer '{name}' already declared")
-        self.setdefault(name, Pointer(self.offset, type))
-        self.offset += 1
+        self.setdefault(name, Pointer(self.allocate(1, shared), type))
 
     def add_iterator(self, name):
         if name in self:
@@ -92,13 +269,16 @@ class Memory(dict):
             if self[name].active:
                 raise Exception(f"Iterator '{name}' is already declared - check for name collision")
             else:
+                # cells of previous loop may have been released
                 self[name].active = True
+                self[name].location = self.allocate(2, True)
+                self[f'{name}_iter_end'].location = self[name].location + 1
         else:
-            self.setdefault(name, Iterator(self.offset))
-            self.setdefault(f'{name}_iter_end', Iterator(self.offset + 1))
-            self.offset += 2   # why 2? because we need to store  !END! value of iterator,
-                               # and that might come from variable, that might be changed inside BODY 
-                               # and iterator doesn't care about that change is saves only initial value
+            location = self.allocate(2, True)  # why 2? because we need to store  !END! value of iterator,
+                                               # and that might come from variable, that might be changed inside BODY 
+                                               # and iterator doesn't care about that change is saves only initial value
+            self.setdefault(name, Iterator(location))
+            self.setdefault(f'{name}_iter_end', Iterator(location + 1))
 
     def delete_iterator(self, name):
         if name not in self:
@@ -153,14 +333,15 @@ class Memory(dict):
         else:
             raise Exception(f"undeclared variable '{name}'")
         
-    def get_array_at_index(self, name, index, get_array_start_location = False):
+    def get_array_at_index(self, name, index):
+        return self.get_array(name).get(index)
+
+    def get_array(self, name):
         if name in self:
             a = self[name]
             
             if isinstance(a, Array):
-                if get_array_start_location:
-                    return a.location
-                return a.get(index)
+                return a
             else:
                 raise Exception(f"'{name}' is not array")
         else:
@@ -172,6 +353,14 @@ class Procedure:
         self.pointers = []
         self.location = location
         self.callback = callback
+        self.constants = dict()     # literal -> estimated number of SETs executed per single call
+        self.args = []              # (type, name) of parameters
+        self.declarations = []      # kept for inlining, with commands
+        self.commands = []
+        self.size = 0               # instructions of body
+        self.code = []              # with labels, assembled into unit and linked into program when it is called
+        self.callees = set()        # procedures called (not inlined) by this one
+        self.end = 0                # first shared cell after shared cells of procedure (and of procedures it calls)
     
     def add_pointer(self, location, type):
         self.pointers.append(Pointer(location, type))
@@ -181,15 +370,150 @@ class Procedure:
 
         
 class Generator:
-    def __init__(self):
+    def __init__(self, disabled = ()):
         self.debug = True
-        self.offset = 15  # since first 15 cells are reserved look: 'TEMP_CELLS_' above
+        self.optimizations = set(OPTIMIZATIONS) - set(disabled)
+        self.offset = FIRST_CELL    # next cell of declared storage (return address, parameters, variables, arrays)
+        self.shared = FIRST_CELL    # first cell of shared storage, after declared storage of the whole program
+        self.top = FIRST_CELL       # first cell after shared cells of every procedure generated so far
         self.memory = None
         self.procedures = dict()
         self.code = []
         self.errorMode = False
         self.loopDepth = 0
         self.lineno = 1
+        self.main_label = Label('main')
+        self.constants = dict()     # literal -> estimated number of SETs executed in currently generated block
+        self.weight = 1             # estimated number of executions of currently generated code
+        self.statistics = Statistics()  # what peephole optimizer did
+        self.pool = dict()          # cell -> literal kept there by constant pool
+        self.routines = dict()      # runtime routine -> [entry label, estimated number of calls, (unit code, return label) of calls]
+        self.inlined = 0            # instructions of inlined routines
+        self.available = dict()     # expression -> (cell that holds its value, names it depends on), inside basic block
+        self.known = dict()         # variable -> its literal value at currently generated command
+        self.calls = dict()         # procedure -> number of places it is called from
+        self.entries = dict()       # procedure -> estimated number of its executions per run of program
+        self.entered = 1            # estimated number of executions of currently generated procedure (or main)
+        self.inlined_procedures = 0 # instructions of inlined procedures
+        self.callees = set()        # procedures called (not inlined) from currently generated procedure or main
+        self.hoisted = 0            # hidden variables of loop invariants and induction variables
+
+    def emit(self, opcode, operand = None):
+        if opcode == 'SET' and isinstance(operand, int):
+            if operand == 0:
+                opcode = 'SUB'  # acc - acc == 0, for 10 instead of 50
+            else:
+                self.constants[operand] = self.constants.get(operand, 0) + self.weight
+        elif opcode == 'STORE' and self.available:
+            self.available = {key: entry for key, entry in self.available.items() if entry[0] != operand}
+        self.code.append(Instruction(opcode, operand))
+
+    # common subexpressions: value of expression stays available in cell until that cell or one of names is written
+    def remember(self, expression, cell, names):
+        if 'common_subexpressions' in self.optimizations:
+            self.available[self.expression_key(expression)] = (cell, frozenset(names))
+
+    def reuse(self, expression):
+        entry = self.available.get(self.expression_key(expression))
+        if entry is None:
+            return False
+        self.emit('LOAD', entry[0])
+        return True
+
+    def expression_key(self, expression):
+        if expression[0] in ('+', '*'):
+            return (expression[0],) + tuple(sorted(expression[1:], key=repr))
+        return expression
+
+    # names value depends on: variables, arrays and their indexes
+    def names(self, value):
+        if value[0] == 'number':
+            return set()
+        if value[0] == 'load':
+            return {value[1]} if isinstance(value[1], str) else self.names(value[1])   # array index is bare name
+        if value[0] in ('variable', 'iterator'):
+            return {value[1]}
+        if value[0] == 'array':
+            return {value[1]} | self.names(value[2])
+        return self.names(value[1]) | self.names(value[2])    # operation
+
+    # name was written
+    def forget(self, name = None):
+        if name is None:
+            self.available = dict()
+            return
+        names = self.aliased({name})
+        self.available = {key: entry for key, entry in self.available.items() if not entry[1] & names}
+
+    # names that may share cells with given ones: parameters may point to the same variable or array,
+    # induction variable points into its array
+    def aliased(self, names):
+        names = set(names)
+        parameters = []
+        walks = []  # (induction variable, its array)
+        for name, cell in self.memory.items():
+            if isinstance(cell, Pointer):
+                if cell.array is None:
+                    parameters.append(name)
+                else:
+                    walks.append((name, cell.array))
+        while True:
+            size = len(names)
+            if any(name in names for name in parameters):
+                names.update(parameters)
+            for name, array in walks:
+                if array in names:
+                    names.add(name)
+                if name in names:
+                    names.add(array)
+            if len(names) == size:
+                return names
+
+    def place(self, label):
+        self.code.append(label)
+
+    # constant propagation: values of variables known after commands (or at head of loop with such body)
+    def propagate(self, commands):
+        if 'constant_propagation' not in self.optimizations:
+            return dict()
+        return transfer(commands, self.known, self.tracked())
+
+    def loop_known(self, block):
+        if 'constant_propagation' not in self.optimizations:
+            return dict()
+        return loop_head(self.known, block, self.tracked())
+
+    def tracked(self):
+        return {name for name, cell in self.memory.items() if isinstance(cell, Variable)}
+
+    # value with variable of known value replaced by literal
+    def literal(self, value):
+        known = value_of(value, self.known)
+        if known is None:
+            return value
+        return ('number', known)
+
+    # number of places every procedure is called from and estimated number of its executions per run of program
+    # (sum over places it is called from of executions of caller weighted by loops around call) - before any code
+    # is generated. Procedure can call only procedures declared before it, so callers are counted before callees
+    def count_calls(self, procedures, main):
+        def count(commands, weight):
+            for command in commands:
+                if command[0] == 'call':
+                    name = command[1][0]
+                    self.calls[name] = self.calls.get(name, 0) + 1
+                    self.entries[name] = self.entries.get(name, 0) + weight
+                elif command[0] == 'ifelse':
+                    count(command[2], weight)
+                    count(command[3], weight)
+                elif command[0] == 'while' or command[0] == 'repeat':
+                    count(command[2], weight * LOOP_WEIGHT)
+                elif command[0] == 'for_to' or command[0] == 'for_downto':
+                    count(command[4], weight * LOOP_WEIGHT)
+
+        count(main[1], 1)
+        for procedure in reversed(procedures):
+            count(procedure[2], self.entries.get(procedure[0][0], 0))
 
     def gen_procedure(self, head, declarations, commands):
         name = head[0]
@@ -198,32 +522,147 @@ class Generator:
         if name in self.procedures:
             print(f"Error: Line {head[2]}: procedure '{name}' already declared")
             return
-        if len(self.code) == 0:
-            self.code.append('PLACEHOLDER')
-        procedure = Procedure(name, len(self.code), self.offset)
-        self.memory = Memory(self.offset + 1)
+        procedure = Procedure(name, Label(name), self.offset)
+        procedure.args = args
+        procedure.declarations = declarations
+        procedure.commands = commands
+        self.constants = procedure.constants
+        self.callees = procedure.callees
+        self.entered = self.entries.get(name, 0)
+        self.code = []
+        self.place(procedure.location)
+        self.forget()
+        self.known = dict()
+        self.memory = Memory(procedure.callback + 1, self.frame(commands))
 
         # gen pointers
         for arg in args:
             self.memory.add_pointer(arg[1], arg[0])
             procedure.add_pointer(self.memory.get_variable(arg[1]), arg[0])
         
+        size = len(self.code)
         self.gen_declarations(declarations)
         self.gen_body(commands)
+        procedure.size = len(self.code) - size
+        procedure.end = self.memory.end()
         self.procedures.setdefault(name, procedure)
         self.offset = self.memory.offset
+        self.top = max(self.top, procedure.end)
 
         # return
-        self.code.append(f'RTRN {procedure.callback}')
+        self.emit('RTRN', procedure.callback)
+        procedure.code = self.code
 
     def gen(self, declarations, commands):
-        if len(self.code) > 0:
-            self.code[0] = f'JUMP {len(self.code)}'
-
-        self.memory = Memory(self.offset)
+        self.code = []
+        self.place(self.main_label)
+        self.forget()
+        self.known = dict()
+        self.constants = dict()
+        self.callees = set()
+        self.entered = 1
+
+        self.memory = Memory(self.offset, self.frame(commands))
         self.gen_declarations(declarations)
         self.gen_body(commands)
-        self.code.append("HALT")
+        self.offset = self.memory.offset
+        self.top = max(self.top, self.memory.end())
+        self.emit('HALT')
+
+        # (name, entry label, code) of every unit - procedures that can't be reached from main (every call of them
+        # was inlined) are dropped. Routines, constant pool and storage are decided for the whole program, only then
+        # every unit is optimized and assembled on its own
+        units = [('main', self.main_label, self.code)]
+        units += [(procedure.name, procedure.location, procedure.code) for procedure in self.reachable()]
+        units += self.gen_routines(units)
+        units = self.pool_constants(units)
+        # procedures pass nothing in temporary cells, runtime routines get operands and leave results there
+        routines = {routine[0] for routine in self.routines.values()}
+        entries = {symbol: ARGUMENTS if symbol in routines else () for (_, symbol, _) in units}
+        units = [assemble(name, symbol, self.optimize_code(code, symbol, entries, RESULTS if symbol in routines else ()))
+                 for (name, symbol, code) in units]
+        self.code = link(units[0], units)
+
+    # procedures called (not inlined) from main, directly or through other procedures, in order of declaration
+    def reachable(self):
+        live = set(self.callees)
+        pending = list(self.callees)
+        while pending:
+            for name in self.procedures[pending.pop()].callees - live:
+                live.add(name)
+                pending.append(name)
+        return [procedure for procedure in self.procedures.values() if procedure.name in live]
+
+    # declared storage of every procedure and main gets its own cells, so variable that is read before it is written
+    # holds what it held before, as without sharing. Shared storage of iterators and hidden variables (always written
+    # before they are read) begins after it - its size is known before any code is generated
+    def reserve(self, procedures, main):
+        size = 0
+        for (head, declarations, _) in procedures:
+            size += 1 + len(head[1])    # return address and parameters
+            size += sum(max(declaration[3] - declaration[2] + 1, 0) if declaration[0] == 'array' else 1
+                        for declaration in declarations)
+        size += sum(max(declaration[3] - declaration[2] + 1, 0) if declaration[0] == 'array' else 1
+                    for declaration in main[0])
+        self.shared = self.top = FIRST_CELL + size
+
+    # first shared cell of procedure (or main) with given commands: without recursion only procedures it calls
+    # (directly or through others, inlined or not) can be running at the same time, so its shared cells begin right
+    # after theirs and iterators and hidden variables of procedures that never run together share cells (declared
+    # storage never does, see reserve)
+    def frame(self, commands):
+        if 'shared_storage' not in self.optimizations:
+            return self.top
+        return max([self.procedures[name].end for name in called(commands) if name in self.procedures], default=self.shared)
+
+    # shared cells allocated while generating block (loop, inlined procedure) are free again after it
+    def release(self, offset):
+        self.memory.drop_hidden(offset)
+        if 'shared_storage' in self.optimizations:
+            self.memory.release(offset)
+
+    # code of single unit, its entry label stays in place; entries - temporary cells read by other units (by their
+    # entry labels), returned - temporary cells read after this one returns
+    def optimize_code(self, code, symbol, entries, returned):
+        rules = {name: rule for name, rule in RULES.items() if name in self.optimizations}
+        if 'peephole' in self.optimizations:
+            code = optimize(code, rules, self.statistics, exported={symbol})
+        if 'value_tracking' in self.optimizations:
+            code = track_values(code, FIRST_CELL, self.pool)
+            code = remove_dead_stores(code, FIRST_CELL, entries, returned)
+            if 'peephole' in self.optimizations:
+                code = optimize(code, rules, self.statistics, exported={symbol})
+        return code
+
+    # literals that are SET often enough get their own cell, initialized once at program start (before main label),
+    # and every 'SET literal' of every unit becomes 'LOAD cell'
+    def pool_constants(self, units):
+        if 'constant_pool' not in self.optimizations:
+            return units
+
+        pool = dict()
+        location = self.top   # first cell after everything main and procedures use
+        for value, executions in sorted(self.constants.items(), key=lambda item: -item[1]):
+            if (SET_COST - LOAD_COST) * executions > POOL_SETUP_COST:
+                pool[value] = location
+                location += 1
+
+        if len(pool) == 0:
+            return units
+
+        setup = []
+        for value, cell in pool.items():
+            setup.append(Instruction('SET', value))
+            setup.append(Instruction('STORE', cell))
+            self.pool[cell] = value
+
+        pooled = []
+        for (name, symbol, code) in units:
+            code = [Instruction('LOAD', pool[instruction.operand])
+                    if instruction.opcode == 'SET' and isinstance(instruction.operand, int) and instruction.operand in pool
+                    else instruction for instruction in code]
+            pooled.append((name, symbol, setup + code if len(pooled) == 0 else code))
+        return pooled
 
     def gen_declarations(self, declarations):
         for declaration in declarations:
@@ -236,18 +675,18 @@ class Generator:
             else: # declaration[0] == "array"
                 try:
                     self.memory.add_array(name=declaration[1], lower_bound=declaration[2], upper_bound=declaration[3])
-                    
-                    #! need to store lower bound in memory cell, so that index dereferencing is properly computed in pointers to array
-                    address = self.memory.get_array_at_index(declaration[1], 0, get_array_start_location=True)
-                    self.code.append(f'SET {declaration[2]}')
-                    self.code.append(f'STORE {address}')
-                
                 except Exception as e:
                     print(f'Error: Line {declaration[4]}: {e}')
                     self.errorMode = True
 
     def gen_body(self, commands):
+        known = self.known
         for command in commands:
+            # commands of blocks below start with self.known of this command and change it, next command
+            # starts with what the whole command leaves
+            self.known = known
+            known = self.propagate([command])
+
             if command[0] == 'assign':
                 target = command[1]
                 expression = command[2]
@@ -258,9 +697,16 @@ class Generator:
                         raise Exception(f"can not modify local iterator '{target[1]}'")
                     
                     self.load_address(target)
-                    self.code.append(f'STORE {TEMP_CELL_B}')
+                    self.emit('STORE', TEMP_CELL_B)
                     self.calculate_expression(expression[1], command[3])
-                    self.code.append(f'STOREI {TEMP_CELL_B}')
+                    self.emit('STOREI', TEMP_CELL_B)
+
+                    # value of expression is kept in variable from now on
+                    self.forget(target[1])
+                    value = expression[1]
+                    if target[0] == 'variable' and isinstance(self.memory[target[1]], Variable) and target[1] not in self.names(value) \
+                            and (value[0] in ('+', '-', '*', '/', '%') or value[0] == 'load' and value[1][0] == 'array'):
+                        self.remember(value[1] if value[0] == 'load' else value, self.memory.get_variable(target[1]), self.names(value) | {target[1]})
 
                 except Exception as e:
                     print(f'Error: Line {command[3]}: {e}')
@@ -271,13 +717,13 @@ class Generator:
             elif command[0] == 'write':
                 target = command[1]
                 if target[0] == 'number':
-                    self.code.append(f'SET {target[1]}')
-                    self.code.append('PUT 0')
+                    self.emit('SET', target[1])
+                    self.emit('PUT', 0)
                 else: # target[0] == 'load'
                     self.lineno = command[2]
                     try:
                         self.load_value(target[1])
-                        self.code.append('PUT 0')
+                        self.emit('PUT', 0)
                     except Exception as e:
                         print(f'Error: Line {command[2]}: {e}')
                         self.errorMode = True
@@ -287,9 +733,10 @@ class Generator:
                 self.lineno = command[2]
                 try:
                     self.load_address(target)
-                    self.code.append(f'STORE {TEMP_CELL_B}')
-                    self.code.append(f'GET 0')
-                    self.code.append(f'STOREI {TEMP_CELL_B}')
+                    self.emit('STORE', TEMP_CELL_B)
+                    self.emit('GET', 0)
+                    self.emit('STOREI', TEMP_CELL_B)
+                    self.forget(target[1])
                 except Exception as e:
                     print(f'Error Line: {command[2]}: {e}')
                     self.errorMode = True
@@ -298,139 +745,73 @@ class Generator:
 
             elif command[0] == 'ifelse':
                 condition = command[1]
-                (condition, swap) = self.simplify_condition(condition)
+                block_a = command[2]
+                block_b = command[3]
 
-                if not swap:
-                    block_a = command[2]
-                    block_b = command[3]
-                else:
-                    block_b = command[2]
-                    block_a = command[3]
-                
-                self.generate_condition(condition)
+                block_b_start = Label()
+                block_b_end = Label()
 
-                before_block_a = len(self.code)
-                self.code.append('JUMP to block_b')
+                self.generate_condition(condition, block_b_start, negation=True)
+                available = dict(self.available)
+                before = self.known
 
                 self.gen_body(block_a)
+                self.emit('JUMP', block_b_end)
+                available_a = self.available
 
-                after_block_a = len(self.code)
-                self.code.append('JUMP to block_b_end')
-
+                self.available = available
+                self.known = before
+                self.place(block_b_start)
                 self.gen_body(block_b)
-
-                after_block_b = len(self.code)
-                self.code[before_block_a] = f'JUMP {after_block_a - before_block_a + 1}'
-                self.code[after_block_a] = f'JUMP {after_block_b - after_block_a}'
+                self.place(block_b_end)
+                # after both blocks only what both of them left is available
+                self.available = {key: entry for key, entry in self.available.items() if available_a.get(key) == entry}
 
             elif command[0] == 'while':
                 condition = command[1]
                 block = command[2]
-                (condition, negation) = self.simplify_condition(condition)
-                
-                before_condition = len(self.code)
-                self.generate_condition(condition)
-
-                if not negation:
-                    before_block = len(self.code)
-                    self.code.append('JUMP to block end')
-                    self.loopDepth += 1
-                    self.gen_body(block)
-                    self.loopDepth -= 1
-                    self.code.append(f'JUMP { before_condition - len(self.code) }')
-                    after_block = len(self.code)
-                    self.code[before_block] = f'JUMP {after_block - before_block}'
-                else: # negation
-                    before_block = len(self.code) - 1
-                    self.loopDepth += 1
-                    self.gen_body(block)
-                    self.loopDepth -= 1
-                    self.code.append(f'JUMP { before_condition - len(self.code)}')
-                    after_block = len(self.code)
-                    if condition[1] == '>':
-                        self.code[before_block] = f'JPOS {after_block - before_block}'
-                    else: # condition[0] =='='
-                        self.code[before_block] = f'JZERO {after_block - before_block}'
+                offset = self.memory.shared
+                preheader = len(self.code)
+                (block, hoisted_condition) = self.hoist_invariants(block, condition)
+                hoisted = self.code[preheader:]
+                del self.code[preheader:]
+                # hidden variables of condition aren't computed yet at first check
+                exit = self.guard_loop(condition)
+                self.code.extend(hoisted)
+                condition = hoisted_condition
+
+                self.weight *= LOOP_WEIGHT
+                self.gen_loop(condition, block, exit=exit)
+                self.weight //= LOOP_WEIGHT
+                self.release(offset)
 
             elif command[0] == 'repeat':
                 condition = command[1]
                 block = command[2]
-                (condition, negation) = self.simplify_condition(condition)
+                offset = self.memory.shared
+                (block, condition) = self.hoist_invariants(block, condition)
 
-                block_start = len(self.code)
-                self.loopDepth += 1
-                self.gen_body(block)
-                self.loopDepth -= 1
-                
-                self.generate_condition(condition)
-                if not negation:
-                    self.code.append(f'JUMP {block_start - len(self.code)}')
-                else: # negation
-                    last_jump = len(self.code) - 1
-                    if condition[1] == '>':
-                        self.code[last_jump] = (f'JPOS {block_start - last_jump}')
-                    else: # condition[0] = '='
-                        self.code[last_jump] = (f'JZERO {block_start - last_jump}')
-            
-            elif command[0] == 'for_to':
-                iterator = command[1]
-                start = command[2]
-                end = command[3]
-                block = command[4]
+                block_start = Label()
 
-                try:
-                    self.memory.add_iterator(iterator)
-                except Exception as e:
-                    print(f'Error: Line {command[5]}: {e}')
-                    self.errorMode = True
-
-                iterator_address = self.memory.get_variable(iterator)
-
-                # store initial values of iterator
-                if start[0] == 'number':
-                    self.code.append(f'SET {start[1]}')
-                    self.code.append(f'STORE {iterator_address}')
-                else: # load 
-                    self.load_value(start[1])
-                    self.code.append(f'STORE {iterator_address}')
-                
-                if end[0] == 'number':
-                    self.code.append(f'SET {end[1]}')
-                    self.code.append(f'STORE {iterator_address + 1}')
-                else: # load
-                    self.load_value(end[1])
-                    self.code.append(f'STORE {iterator_address + 1}')
-              
-
-                condition = ('comparison', '<=', ('load', ('iterator', iterator)), ('load', ('iterator', f'{iterator}_iter_end')) )
-                block = command[4]
-                (condition, negation) = self.simplify_condition(condition)
-                
-                before_condition = len(self.code)
-                self.generate_condition(condition)
-
-                before_block = len(self.code) - 1
+                self.weight *= LOOP_WEIGHT
+                self.place(block_start)
+                self.forget()
+                self.known = self.loop_known(block)
                 self.loopDepth += 1
                 self.gen_body(block)
                 self.loopDepth -= 1
-                
-                # increment iterator 
-                self.code.append(f'SET 1')
-                self.code.append(f'ADD {iterator_address}')
-                self.code.append(f'STORE {iterator_address}')
-
-                self.code.append(f'JUMP { before_condition - len(self.code)}')
-                after_block = len(self.code)
-                self.code[before_block] = f'JPOS {after_block - before_block}'
-            
-                self.memory.delete_iterator(iterator[0])
+                # condition not met means next iteration
+                self.generate_condition(condition, block_start, negation=True)
+                self.weight //= LOOP_WEIGHT
+                self.release(offset)
             
-            elif command[0] == 'for_downto':
+            elif command[0] == 'for_to' or command[0] == 'for_downto':
                 iterator = command[1]
                 start = command[2]
                 end = command[3]
                 block = command[4]
 
+                offset = self.memory.shared
                 try:
                     self.memory.add_iterator(iterator)
                 except Exception as e:
@@ -438,44 +819,59 @@ class Generator:
                     self.errorMode = True
 
                 iterator_address = self.memory.get_variable(iterator)
+                self.forget(iterator)
 
+                # store initial values of iterator
                 if start[0] == 'number':
-                    self.code.append(f'SET {start[1]}')
-                    self.code.append(f'STORE {iterator_address}')
+                    self.emit('SET', start[1])
+                    self.emit('STORE', iterator_address)
                 else: # load 
                     self.load_value(start[1])
-                    self.code.append(f'STORE {iterator_address}')
+                    self.emit('STORE', iterator_address)
                 
                 if end[0] == 'number':
-                    self.code.append(f'SET {end[1]}')
-                    self.code.append(f'STORE {iterator_address + 1}')
+                    self.emit('SET', end[1])
+                    self.emit('STORE', iterator_address + 1)
                 else: # load
                     self.load_value(end[1])
-                    self.code.append(f'STORE {iterator_address + 1}')
-              
-
-                condition = ('comparison', '>=', ('load', ('iterator', iterator)), ('load', ('iterator', f'{iterator}_iter_end')) )
-                block = command[4]
-                (condition, negation) = self.simplify_condition(condition)
-                
-                before_condition = len(self.code)
-                self.generate_condition(condition)
-
-                before_block = len(self.code) - 1
-                self.loopDepth += 1
-                self.gen_body(block)
-                self.loopDepth -= 1
-                
-                # decrement iterator 
-                self.code.append(f'SET -1')
-                self.code.append(f'ADD {iterator_address}')
-                self.code.append(f'STORE {iterator_address}')
-
-                self.code.append(f'JUMP { before_condition - len(self.code)}')
-                after_block = len(self.code)
-                self.code[before_block] = f'JPOS {after_block - before_block}'
-
-                self.memory.delete_iterator(iterator[0])
+                    self.emit('STORE', iterator_address + 1)
+
+                if command[0] == 'for_to':
+                    condition = ('comparison', '<=', ('load', ('iterator', iterator)), ('load', ('iterator', f'{iterator}_iter_end')) )
+                    step = 1
+                else: # command[0] == 'for_downto'
+                    condition = ('comparison', '>=', ('load', ('iterator', iterator)), ('load', ('iterator', f'{iterator}_iter_end')) )
+                    step = -1
+
+                # with literal bounds first check of condition is known at compile time
+                (first, last) = (value_of(start, self.known), value_of(end, self.known))
+                entered = first is not None and last is not None and (last - first) * step >= 0
+
+                preheader = len(self.code)
+                (block, _) = self.hoist_invariants(block, iterator = iterator)
+                (block, updates) = self.induction_variables(block, iterator, step)
+                hoisted = self.code[preheader:]
+                del self.code[preheader:]
+
+                # iterator nobody reads isn't updated at all - cell of end value counts iterations instead,
+                # from minus number of remaining ones after the first one up to 0 (the same step 1 as other loops)
+                if 'counted_loops' in self.optimizations and not reads(block, iterator):
+                    (minuend, subtrahend) = (iterator_address, iterator_address + 1) if step > 0 else (iterator_address + 1, iterator_address)
+                    self.emit('LOAD', minuend)
+                    self.emit('SUB', subtrahend)
+                    self.emit('STORE', iterator_address + 1)
+                    condition = ('comparison', '<=', ('load', ('iterator', f'{iterator}_iter_end')), ('number', 0))
+                    (iterator_address, step) = (iterator_address + 1, 1)
+
+                exit = self.guard_loop(condition) if not entered else None
+                self.code.extend(hoisted)
+
+                self.weight *= LOOP_WEIGHT
+                self.gen_loop(condition, block, iterator_address, step, guarded=not entered, updates=updates, exit=exit)
+                self.weight //= LOOP_WEIGHT
+
+                self.memory.delete_iterator(iterator)
+                self.release(offset)
             
             elif command[0] == 'call':
                 name = command[1][0]
@@ -498,6 +894,7 @@ class Generator:
                     print(f"Error: Line {lineno}: procedure '{name}' expects: {len(procedure.pointers)} parameter(s), provided: {len(args)}")
                     self.errorMode = True
                     continue
+                types = []
                 for i in range(len(args)):
                     type = self.memory.get_type(args[i])
                     if type == 'pointer':
@@ -506,412 +903,570 @@ class Generator:
                     if type != procedure.pointers[i].type:
                         print(f"Error: Line {lineno}: incorect type of argument provided to procedure '{name}'\n\tExpected: '{procedure.pointers[i].type}' but '{type}' was provided")
                         self.errorMode = True
+                    types.append(type)
+
+                if self.inline(procedure, args):
+                    continue
+
+                for i in range(len(args)):
+                    type = types[i]
+                    if type != procedure.pointers[i].type:
                         continue
                     
                     if type == 'variable':
                         self.load_address((type, args[i]))
                     else: # type == 'array'
-                        # load and store lower bound as first memory cell of array
-                        self.code.append(f'SET {self.memory.get_variable(args[i])}')
+                        # address of element 0 (it may lie outside of array), pointer to array is passed on as it is
+                        array = self.memory[args[i]]
+                        if isinstance(array, Array):
+                            self.emit('SET', array.base())
+                        else:
+                            self.emit('LOAD', array.location)
                     
-                    self.code.append(f'STORE {procedure.pointers[i].location}')
+                    self.emit('STORE', procedure.pointers[i].location)
                 
                 # saving location for return
-                self.code.append(f'SET {len(self.code) + 3}')
-                self.code.append(f'STORE {procedure.callback}')
-                self.code.append(f'JUMP {procedure.location - len(self.code)}')
+                self.callees.add(name)
+                return_label = Label()
+                self.emit('SET', return_label)
+                self.emit('STORE', procedure.callback)
+                self.emit('JUMP', procedure.location)
+                self.place(return_label)
+                self.forget()
+
+                # literals SET inside procedure are executed once per call
+                for value, executions in procedure.constants.items():
+                    self.constants[value] = self.constants.get(value, 0) + executions * self.weight
+
+        self.known = known
+
+    # body of procedure generated in place of call, with caller's variables and arrays in place of pointers -
+    # direct LOAD/STORE and fixed addresses instead of LOADI/STOREI. Locals keep cells of procedure itself
+    # (no recursion, so procedure can't be running at the same time). False when call has to be emitted
+    def inline(self, procedure, args):
+        if 'inlining' not in self.optimizations or self.errorMode or len(set(args)) != len(args):
+            return False    # same argument twice - pointers would alias each other
+        if self.calls.get(procedure.name, 0) > 1 and procedure.size > PROCEDURE_INLINE_SIZE:
+            return False
+        if self.inlined_procedures + procedure.size > PROCEDURE_INLINE_BUDGET:
+            return False
+
+        memory = Memory(procedure.callback + 1, self.memory.shared)
+        for (type, name), arg in zip(procedure.args, args):
+            memory.add_pointer(name, type)  # keeps cells of locals the same
+            memory[name] = self.memory[arg]
+        # literal index out of bounds of caller's array is left to runtime, as without inlining
+        for (name, index) in literal_indexes(procedure.commands):
+            array = memory.get(name)
+            if isinstance(array, Array) and not array.lower_bound <= index <= array.upper_bound:
+                return False
+
+        state = (self.memory, self.known, len(self.code))
+        offset = self.memory.shared
+        self.memory = memory
+        self.known = dict()
+        self.forget()
+        # diagnostics of body were already printed when procedure was generated
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.gen_declarations(procedure.declarations)
+            # iterators and hidden variables of this copy take shared cells of caller, they may differ from procedure's own
+            self.gen_body(procedure.commands)
+        state[0].shared = memory.end()
+        (self.memory, self.known, size) = state
+        self.release(offset)
+        self.forget()
+        self.inlined_procedures += len(self.code) - size
+        return True
 
     def multiply(self, factor_address1, factor_address2, flag_address = TEMP_CELL_G):
+        multiplier_flag = Label()
+        compare_factors = Label()
+        loop_start = Label()
+        skip_addition = Label()
+        loop_end = Label()
+        load_result = Label()
        
         # r30:  multiplicand    factor_address1
         # r31:  multiplier      factor_address2
         # r32:  result          TEMP_CELL_H
         # r37:  negative flag   TEMP_CELL_G
 
-        self.code.append(f'SET 0')
-        self.code.append(f'STORE {TEMP_CELL_H}')  # result
-        self.code.append(f'SET 1')
-        self.code.append(f'STORE {flag_address}')  # negative flag
+        self.emit('SET', 0)
+        self.emit('STORE', TEMP_CELL_H)  # result
+        self.emit('SET', 1)
+        self.emit('STORE', flag_address)  # negative flag
 
         # multiplicand flag setup
-        self.code.append(f'LOAD {factor_address1}')
-        self.code.append(f'JPOS 10')
-        self.code.append(f'JZERO 9')
-        self.code.append(f'LOAD {flag_address}')
-        self.code.append(f'SUB {flag_address}')
-        self.code.append(f'SUB {flag_address}')
-        self.code.append(f'STORE {flag_address}')
+        self.emit('LOAD', factor_address1)
+        self.emit('JPOS', multiplier_flag)
+        self.emit('JZERO', multiplier_flag)
+        self.emit('LOAD', flag_address)
+        self.emit('SUB', flag_address)
+        self.emit('SUB', flag_address)
+        self.emit('STORE', flag_address)
 
         # flag setup
-        self.code.append(f'LOAD {factor_address1}')
-        self.code.append(f'SUB {factor_address1}')
-        self.code.append(f'SUB {factor_address1}')
-        self.code.append(f'STORE {factor_address1}')
+        self.emit('LOAD', factor_address1)
+        self.emit('SUB', factor_address1)
+        self.emit('SUB', factor_address1)
+        self.emit('STORE', factor_address1)
 
         # multiplier flag setup
-        self.code.append(f'LOAD {factor_address2}')
-        self.code.append(f'JPOS 10')
-        self.code.append(f'JZERO 9')
-        self.code.append(f'LOAD {flag_address}')
-        self.code.append(f'SUB {flag_address}')
-        self.code.append(f'SUB {flag_address}')
-        self.code.append(f'STORE {flag_address}')
+        self.place(multiplier_flag)
+        self.emit('LOAD', factor_address2)
+        self.emit('JPOS', compare_factors)
+        self.emit('JZERO', compare_factors)
+        self.emit('LOAD', flag_address)
+        self.emit('SUB', flag_address)
+        self.emit('SUB', flag_address)
+        self.emit('STORE', flag_address)
 
         # make multiplier positive
-        self.code.append(f'LOAD {factor_address2}')
-        self.code.append(f'SUB {factor_address2}')
-        self.code.append(f'SUB {factor_address2}')
-        self.code.append(f'STORE {factor_address2}')
+        self.emit('LOAD', factor_address2)
+        self.emit('SUB', factor_address2)
+        self.emit('SUB', factor_address2)
+        self.emit('STORE', factor_address2)
 
         # if multiplicand < multiplier: swap them
-        self.code.append(f'LOAD {factor_address1}')
-        self.code.append(f'SUB {factor_address2}')
-        self.code.append(f'JPOS 10')
-        self.code.append(f'LOAD {factor_address1}')
-        self.code.append(f'ADD {factor_address2}')
-        self.code.append(f'STORE {factor_address1}')
-        self.code.append(f'LOAD {factor_address1}')
-        self.code.append(f'SUB {factor_address2}')
-        self.code.append(f'STORE {factor_address2}')
-        self.code.append(f'LOAD {factor_address1}')
-        self.code.append(f'SUB {factor_address2}')
-        self.code.append(f'STORE {factor_address1}')
+        self.place(compare_factors)
+        self.emit('LOAD', factor_address1)
+        self.emit('SUB', factor_address2)
+        self.emit('JPOS', loop_start)
+        self.emit('LOAD', factor_address1)
+        self.emit('ADD', factor_address2)
+        self.emit('STORE', factor_address1)
+        self.emit('LOAD', factor_address1)
+        self.emit('SUB', factor_address2)
+        self.emit('STORE', factor_address2)
+        self.emit('LOAD', factor_address1)
+        self.emit('SUB', factor_address2)
+        self.emit('STORE', factor_address1)
 
         # while multiplier > 0:
-        self.code.append(f'LOAD {factor_address2}')
-        self.code.append(f'JZERO 17')
-        self.code.append(f'JNEG 16')
+        self.place(loop_start)
+        self.emit('LOAD', factor_address2)
+        self.emit('JZERO', loop_end)
+        self.emit('JNEG', loop_end)
 
         # if multiplier % 2 == 1:
-        self.code.append(f'LOAD {factor_address2}')
-        self.code.append(f'HALF')
-        self.code.append(f'ADD 0')
-        self.code.append(f'SUB {factor_address2}')
-        self.code.append(f'JZERO 4')
+        self.emit('LOAD', factor_address2)
+        self.emit('HALF')
+        self.emit('ADD', 0)
+        self.emit('SUB', factor_address2)
+        self.emit('JZERO', skip_addition)
 
         # result = result + multiplicand
-        self.code.append(f'LOAD {TEMP_CELL_H}')
-        self.code.append(f'ADD {factor_address1}')
-        self.code.append(f'STORE {TEMP_CELL_H}')
+        self.emit('LOAD', TEMP_CELL_H)
+        self.emit('ADD', factor_address1)
+        self.emit('STORE', TEMP_CELL_H)
 
         # multiplicand = multiplicand * 2
-        self.code.append(f'LOAD {factor_address1}')
-        self.code.append(f'ADD {factor_address1}')
-        self.code.append(f'STORE {factor_address1}')
+        self.place(skip_addition)
+        self.emit('LOAD', factor_address1)
+        self.emit('ADD', factor_address1)
+        self.emit('STORE', factor_address1)
 
         # multiplier = multiplier / 2
-        self.code.append(f'LOAD {factor_address2}')
-        self.code.append(f'HALF')
-        self.code.append(f'STORE {factor_address2}')
+        self.emit('LOAD', factor_address2)
+        self.emit('HALF')
+        self.emit('STORE', factor_address2)
 
-        self.code.append(f'JUMP -17')
+        self.emit('JUMP', loop_start)
 
         # if flag < 0; change result sign
-        self.code.append(f'LOAD {flag_address}')
-        self.code.append(f'JPOS 5')
-        self.code.append(f'LOAD {TEMP_CELL_H}')
-        self.code.append(f'SUB {TEMP_CELL_H}')
-        self.code.append(f'SUB {TEMP_CELL_H}')
-        self.code.append(f'STORE {TEMP_CELL_H}')
+        self.place(loop_end)
+        self.emit('LOAD', flag_address)
+        self.emit('JPOS', load_result)
+        self.emit('LOAD', TEMP_CELL_H)
+        self.emit('SUB', TEMP_CELL_H)
+        self.emit('SUB', TEMP_CELL_H)
+        self.emit('STORE', TEMP_CELL_H)
 
         # load result
-        self.code.append(f'LOAD {TEMP_CELL_H}')
-
-
-    def divide(self, dividend_address, divisor_address):
-
-        
-        # r30:  dividend            dividend_address    
-        # r31:  divisor             divisor_address     
-
-
-        # r32:  quotient - Q        TEMP_CELL_G = 8     
-        # r33:  remainder - R       TEMP_CELL_H = 9  
-
-        # r34:  temp divisor - D    TEMP_CELL_I = 10  
-
-        # r35:  1                   TEMP_CELL_J
-
-        # r36:  multiple - M        TEMP_CELL_K
-
-        # r37:  negative flag       TEMP_CELL_L = 11   
-
-
-        # setup
-        self.code.append(f'SET 1') # 1 to TEMP_CELL_J
-        self.code.append(f'STORE {TEMP_CELL_J}') 
-        self.code.append(f'SET 1') # negative flag to TEMP_CELL_L
-        self.code.append(f'STORE {TEMP_CELL_L}')
-        
-        # # dividend flag setup
-        self.code.append(f'LOAD {dividend_address}') 
-        self.code.append(f'JPOS 10') 
-        self.code.append(f'JZERO 9')
-        self.code.append(f'LOAD {TEMP_CELL_L}') 
-        self.code.append(f'SUB {TEMP_CELL_L}')
-        self.code.append(f'SUB {TEMP_CELL_L}')
-        self.code.append(f'STORE {TEMP_CELL_L}')
-        #  dividend pos
-        self.code.append(f'LOAD {dividend_address}')
-        self.code.append(f'SUB {dividend_address}')
-        self.code.append(f'SUB {dividend_address}')
-        self.code.append(f'STORE {dividend_address}')
-        
-        # divisor flag setup
-        self.code.append(f'LOAD {divisor_address}') 
-        self.code.append(f'JPOS 10')
-        self.code.append(f'JZERO 9')
-        self.code.append(f'LOAD {TEMP_CELL_L}')
-        self.code.append(f'SUB {TEMP_CELL_L}')
-        self.code.append(f'SUB {TEMP_CELL_L}')
-        self.code.append(f'STORE {TEMP_CELL_L}')
-        # make dividend pos
-        self.code.append(f'LOAD {divisor_address}')
-        self.code.append(f'SUB {divisor_address}') 
-        self.code.append(f'SUB {divisor_address}') 
-        self.code.append(f'STORE {divisor_address}') 
-
-        # setup Q and R
-        self.code.append(f'SET 0') # Q = 0 to r32
-        self.code.append(f'STORE {TEMP_CELL_G}')
-        self.code.append(f'LOAD {dividend_address}') # R = dividend to r33
-        self.code.append(f'STORE {TEMP_CELL_H}')
-
-        # if divisor == 0; return TODO
-        self.code.append(f'LOAD {divisor_address}') 
-        self.code.append(f'JZERO 32')
-
-        # BEGIN WHILE_2
-        # while divisor <= remainder:
-        self.code.append(f'LOAD {TEMP_CELL_H}')
-        self.code.append(f'SUB {divisor_address}')
-        self.code.append(f'JNEG 23')
-
-        # before loop1
-        # temp_divisor = divisor
-        self.code.append(f'LOAD {divisor_address}') # D = divisor to r34
-        self.code.append(f'STORE {TEMP_CELL_I}')
-        # multiple = 1
-        self.code.append(f'LOAD {TEMP_CELL_J}')
-        self.code.append(f'STORE {TEMP_CELL_K}') # M = 1 to r36
-        
-        # BEGIN WHILE_1                
-        # while temp_divisor * 2 <= remainder:
-        self.code.append(f'LOAD {TEMP_CELL_H}')
-        self.code.append(f'SUB {TEMP_CELL_I}')
-        self.code.append(f'SUB {TEMP_CELL_I}')
-        self.code.append(f'JNEG 8') # if D > R, escape loop
-        
-        # temp_divisor = temp_divisor * 2
-        self.code.append(f'LOAD {TEMP_CELL_I}')
-        self.code.append(f'ADD {TEMP_CELL_I}')
-        self.code.append(f'STORE {TEMP_CELL_I}')
-        
-        # multiple = multiple * 2
-        self.code.append(f'LOAD {TEMP_CELL_K}')
-        self.code.append(f'ADD {TEMP_CELL_K}')
-        self.code.append(f'STORE {TEMP_CELL_K}')
-        
-        # jump back to loop1
-        self.code.append(f'JUMP -10')
-        # END WHILE_1
-        
-        # after loop1
-        # remainder = remainder - temp_divisor
-        self.code.append(f'LOAD {TEMP_CELL_H}')
-        self.code.append(f'SUB {TEMP_CELL_I}')
-        self.code.append(f'STORE {TEMP_CELL_H}')
-        # quotient = quotient + multiple
-        self.code.append(f'LOAD {TEMP_CELL_G}')
-        self.code.append(f'ADD {TEMP_CELL_K}')
-        self.code.append(f'STORE {TEMP_CELL_G}')
-        
-        # jump back to loop2
-        self.code.append(f'JUMP -24')
-        # END WHILE_2
-        
-        # if flag < 0; change result sign
-        self.code.append(f'LOAD {TEMP_CELL_L}')
-        self.code.append(f'JPOS 5')
-        self.code.append(f'LOAD {TEMP_CELL_G}')
-        self.code.append(f'SUB {TEMP_CELL_G}')
-        self.code.append(f'SUB {TEMP_CELL_G}')
-        self.code.append(f'STORE {TEMP_CELL_G}')
-
-        # return quotient
-        self.code.append(f'LOAD {TEMP_CELL_G}')
-
-
-    def modulo(self, dividend_address, divisor_address):
- 
-        
-        # r30:  dividend dividend_address    
-        # r31:  divisor  divisor_address     # calculate_expression
-
-
-        # r32:  quotient - Q   TEMP_CELL_G = 8     # calculate_expression
-        # r33:  remainder - R  TEMP_CELL_H = 9     # calculate_expression
-
-        # r34:  temp divisor - D  TEMP_CELL_I = 10    # calculate_expression
-
-        # r35:  1 TEMP_CELL_J
-
-        # r36:  multiple - M TEMP_CELL_K
-
-        # r37:  negative flag
-        # TEMP_CELL_L = 11    # calculate_expression
-
-
-        # setup
-        self.code.append(f'SET 1') # 1 to TEMP_CELL_J
-        self.code.append(f'STORE {TEMP_CELL_J}') 
-        self.code.append(f'SET 1') # negative flag to TEMP_CELL_L
-        self.code.append(f'STORE {TEMP_CELL_L}')
-        
-        # # dividend flag setup
-        self.code.append(f'LOAD {dividend_address}') 
-        self.code.append(f'JPOS 6')
-        self.code.append(f'JZERO 5')
-       
-        #  dividend pos
-        self.code.append(f'LOAD {dividend_address}')
-        self.code.append(f'SUB {dividend_address}')
-        self.code.append(f'SUB {dividend_address}')
-        self.code.append(f'STORE {dividend_address}')
-        
-        #flag setup
-        self.code.append(f'LOAD {divisor_address}') 
-        self.code.append(f'JPOS  10')
-        self.code.append(f'JZERO  9')
-        self.code.append(f'LOAD {TEMP_CELL_L}')
-        self.code.append(f'SUB {TEMP_CELL_L}')
-        self.code.append(f'SUB {TEMP_CELL_L}')
-        self.code.append(f'STORE {TEMP_CELL_L}')
-        # make dividend pos
-        self.code.append(f'LOAD {divisor_address}')
-        self.code.append(f'SUB {divisor_address}') 
-        self.code.append(f'SUB {divisor_address}') 
-        self.code.append(f'STORE {divisor_address}') 
-
-        # setup Q and R
-        self.code.append(f'SET  0') # Q = 0 to r32
-        self.code.append(f'STORE {TEMP_CELL_G}')
-        self.code.append(f'LOAD {dividend_address}') # R = dividend to r33
-        self.code.append(f'STORE {TEMP_CELL_H}')
-
-        # if divisor == 0; return TODO
-        self.code.append(f'LOAD {divisor_address}') 
-        self.code.append(f'JZERO 32')
-
-        # BEGIN WHILE_2
-        # while divisor <= remainder:
-        self.code.append(f'LOAD {TEMP_CELL_H}')
-        self.code.append(f'SUB {divisor_address}')
-        self.code.append(f'JNEG 23')
-
-        # before loop1
-        # temp_divisor = divisor
-        self.code.append(f'LOAD {divisor_address}') # D = divisor to r34
-        self.code.append(f'STORE {TEMP_CELL_I}')
-        # multiple = 1
-        self.code.append(f'LOAD {TEMP_CELL_J}')
-        self.code.append(f'STORE {TEMP_CELL_K}') # M = 1 to r36
-        
-        # BEGIN WHILE_1                
-        # while temp_divisor * 2 <= remainder:
-        self.code.append(f'LOAD {TEMP_CELL_H}')
-        self.code.append(f'SUB {TEMP_CELL_I}')
-        self.code.append(f'SUB {TEMP_CELL_I}')
-        self.code.append(f'JNEG  8') # if D > R, escape loop
-        
-        # temp_divisor = temp_divisor * 2
-        self.code.append(f'LOAD {TEMP_CELL_I}')
-        self.code.append(f'ADD {TEMP_CELL_I}')
-        self.code.append(f'STORE {TEMP_CELL_I}')
-        
-        # multiple = multiple * 2
-        self.code.append(f'LOAD  {TEMP_CELL_K}')
-        self.code.append(f'ADD {TEMP_CELL_K}')
-        self.code.append(f'STORE  {TEMP_CELL_K}')
-        
-        # jump back to loop1
-        self.code.append(f'JUMP -10')
-        # END WHILE_1
-        
-        # after loop1
-        # remainder = remainder - temp_divisor
-        self.code.append(f'LOAD {TEMP_CELL_H}')
-        self.code.append(f'SUB {TEMP_CELL_I}')
-        self.code.append(f'STORE {TEMP_CELL_H}')
-        # quotient = quotient + multiple
-        self.code.append(f'LOAD {TEMP_CELL_G}')
-        self.code.append(f'ADD {TEMP_CELL_K}')
-        self.code.append(f'STORE {TEMP_CELL_G}')
-        
-        # jump back to loop2
-        self.code.append(f'JUMP -24')
-        # END WHILE_2
-        
-        # if flag < 0; change result sign
-        self.code.append(f'LOAD  {TEMP_CELL_L}')
-        self.code.append(f'JPOS 5')
-        self.code.append(f'LOAD {TEMP_CELL_H}')
-        self.code.append(f'SUB {TEMP_CELL_H}')
-        self.code.append(f'SUB {TEMP_CELL_H}')
-        self.code.append(f'STORE {TEMP_CELL_H}')
-
-        # return remainder
-        self.code.append(f'LOAD {TEMP_CELL_H}')
-
-
-    def generate_condition(self, condition):
+        self.place(load_result)
+        self.emit('LOAD', TEMP_CELL_H)
+
+
+    # quotient to TEMP_CELL_G and remainder to TEMP_CELL_H, rounded down (remainder has sign of divisor),
+    # both are 0 when divisor is 0. Quotient of absolute values is computed in single pass of long division:
+    # divisor is doubled until it exceeds dividend, then halved back while bits of quotient are collected
+    def divmod(self, dividend_address, divisor_address):
+        quotient = TEMP_CELL_G
+        remainder = TEMP_CELL_H
+        divisor = TEMP_CELL_I   # shifted |divisor|
+        magnitude = TEMP_CELL_K # |divisor|
+
+        divisor_positive = Label()
+        dividend_positive = Label()
+        scale = Label()
+        reduce = Label()
+        zero_bit = Label()
+        next_bit = Label()
+        equal = Label()
+        one = Label()
+        signs = Label()
+        dividend_negative = Label()
+        differ = Label()
+        exact = Label()
+        negative_remainder = Label()
+        zero = Label()
+        done = Label()
+
+        # |divisor|, |dividend|
+        self.emit('LOAD', divisor_address)
+        self.emit('JZERO', zero)
+        self.emit('JPOS', divisor_positive)
+        self.emit('SET', 0)
+        self.emit('SUB', divisor_address)
+        self.place(divisor_positive)
+        self.emit('STORE', magnitude)
+        self.emit('LOAD', dividend_address)
+        self.emit('JPOS', dividend_positive)
+        self.emit('SET', 0)
+        self.emit('SUB', dividend_address)
+        self.place(dividend_positive)
+        self.emit('STORE', remainder)
+        self.emit('SET', 0)
+        self.emit('STORE', quotient)
+
+        # fast paths: |dividend| < |divisor|, |dividend| == |divisor|, |divisor| == 1
+        self.emit('LOAD', remainder)
+        self.emit('SUB', magnitude)
+        self.emit('JNEG', signs)
+        self.emit('JZERO', equal)
+        self.emit('LOAD', magnitude)
+        self.emit('HALF')
+        self.emit('JZERO', one)
+
+        # double divisor while it is not greater than remainder
+        self.emit('LOAD', magnitude)
+        self.emit('STORE', divisor)
+        self.place(scale)
+        self.emit('LOAD', divisor)
+        self.emit('ADD', 0)
+        self.emit('STORE', divisor)
+        self.emit('SUB', remainder)
+        self.emit('JNEG', scale)
+        self.emit('JZERO', scale)
+
+        # halve it back, every halving gives next bit of quotient
+        self.place(reduce)
+        self.emit('LOAD', divisor)
+        self.emit('HALF')
+        self.emit('STORE', divisor)
+        self.emit('LOAD', remainder)
+        self.emit('SUB', divisor)
+        self.emit('JNEG', zero_bit)
+        self.emit('STORE', remainder)
+        self.emit('SET', 1)
+        self.emit('ADD', quotient)
+        self.emit('ADD', quotient)
+        self.emit('STORE', quotient)
+        self.emit('JUMP', next_bit)
+        self.place(zero_bit)
+        self.emit('LOAD', quotient)
+        self.emit('ADD', 0)
+        self.emit('STORE', quotient)
+        self.place(next_bit)
+        self.emit('LOAD', divisor)
+        self.emit('SUB', magnitude)
+        self.emit('JPOS', reduce)
+
+        # signs: quotient of operands with different signs is rounded down, remainder takes sign of divisor
+        self.place(signs)
+        self.emit('LOAD', dividend_address)
+        self.emit('JNEG', dividend_negative)
+        self.emit('LOAD', divisor_address)
+        self.emit('JPOS', done)
+        self.emit('JUMP', differ)
+        self.place(dividend_negative)
+        self.emit('LOAD', divisor_address)
+        self.emit('JNEG', negative_remainder)
+        self.place(differ)
+        self.emit('LOAD', remainder)
+        self.emit('JZERO', exact)
+        self.emit('LOAD', magnitude)
+        self.emit('SUB', remainder)
+        self.emit('STORE', remainder)
+        self.emit('SET', 1)
+        self.emit('ADD', quotient)
+        self.emit('STORE', quotient)
+        self.emit('SET', 0)
+        self.place(exact)
+        self.emit('SUB', quotient)
+        self.emit('STORE', quotient)
+        self.emit('LOAD', divisor_address)
+        self.emit('JPOS', done)
+        self.place(negative_remainder)
+        self.emit('SET', 0)
+        self.emit('SUB', remainder)
+        self.emit('STORE', remainder)
+        self.emit('JUMP', done)
+
+        self.place(equal)
+        self.emit('SET', 1)
+        self.emit('STORE', quotient)
+        self.emit('SET', 0)
+        self.emit('STORE', remainder)
+        self.emit('JUMP', signs)
+
+        self.place(one)
+        self.emit('LOAD', remainder)
+        self.emit('STORE', quotient)
+        self.emit('SET', 0)
+        self.emit('STORE', remainder)
+        self.emit('JUMP', signs)
+
+        self.place(zero)
+        self.emit('STORE', quotient)
+        self.emit('STORE', remainder)
+        self.place(done)
+
+
+    # jumps to 'label' when condition is met (with negation: when it is not met), otherwise falls through
+    def generate_condition(self, condition, label, negation = False):
         operator = condition[1]
         first_value = condition[2]
         second_value = condition[3]
 
+        # outcome known at compile time - jump or nothing (code that can't be reached is removed by peephole)
+        (first_known, second_known) = (value_of(first_value, self.known), value_of(second_value, self.known))
+        if first_known is not None and second_known is not None:
+            if compare(operator, first_known, second_known) != negation:
+                self.emit('JUMP', label)
+            return
+        if negation:
+            operator = COMPLEMENT[operator]
+
+        # comparison with zero needs only the other value in accumulator, otherwise second value is subtracted
+        # straight from its cell - values are swapped when only the first one is in cell
+        if first_known == 0 or second_known != 0 and self.direct_operand(second_value) is None \
+                and self.direct_operand(first_value) is not None:
+            (first_value, second_value, second_known) = (second_value, first_value, first_known)
+            operator = MIRROR[operator]
+
+        if second_known == 0:
+            self.load_operand(first_value)
+        else:
+            subtrahend = self.direct_operand(second_value)
+            if subtrahend is None:
+                self.load_operand(second_value)
+                self.emit('STORE', TEMP_CELL_D)
+                subtrahend = ('SUB', TEMP_CELL_D)
+            self.load_operand(first_value)
+            self.emit(*subtrahend)
+
+        for jump in BRANCHES[operator]:
+            self.emit(jump, label)
+
+    # instruction subtracting value without accumulator, None when value has to be computed first
+    def direct_operand(self, value, opcode = 'SUB'):
+        if value[0] != 'load' or value[1][0] not in ('variable', 'iterator') or value[1][1] not in self.memory:
+            return None
+        cell = self.memory[value[1][1]]
+        if isinstance(cell, Variable) or isinstance(cell, Iterator):
+            return (opcode, cell.location)
+        if isinstance(cell, Pointer) and cell.type == 'variable':
+            return (f'{opcode}I', cell.location)
+        return None
+
+    def load_operand(self, value):
+        if value[0] == 'number':
+            self.emit('SET', value[1])
+        else: # value[0] == 'load'
+            self.load_value(value[1])
+
+    # loop invariant code motion: values that don't change in loop (expressions over variables not written in it,
+    # elements of arrays not written in it, values of pointers) are computed once before loop, to hidden variables
+    # that take their place in loop. Returns block and condition with them
+    def hoist_invariants(self, block, condition = None, iterator = None):
+        if 'loop_invariants' not in self.optimizations:
+            return (block, condition)
+
+        modified = written(block)
+        if iterator is not None:
+            modified.add(iterator)
+        modified = self.aliased(modified)
+
+        hoisted = dict()    # expression -> hidden variable
+        def invariant(value):
+            if value[0] == 'number':
+                return True
+            identifier = value[1]
+            if identifier[0] == 'variable':
+                return self.ready(identifier[1]) and identifier[1] not in modified
+            # array
+            return identifier[1] in self.memory and identifier[1] not in modified \
+                and (identifier[2][0] == 'number' or self.ready(identifier[2][1]) and identifier[2][1] not in modified)
+
+        def replace_value(value):
+            if value[0] == 'load' and invariant(value):
+                cell = self.memory.get(value[1][1])
+                # element of array or value of pointer - direct LOAD of hidden variable instead
+                if value[1][0] == 'array' and (isinstance(cell, Pointer) or value[1][2][0] == 'load') or isinstance(cell, Pointer) and cell.type == 'variable':
+                    return hide(value)
+            return value
+
+        def replace_expression(expression):
+            if expression[0] in ('number', 'load'):
+                return replace_value(expression)
+            if invariant(expression[1]) and invariant(expression[2]) and not (expression[1][0] == 'number' and expression[2][0] == 'number'):
+                return hide(expression)
+            return (expression[0], replace_value(expression[1]), replace_value(expression[2]))
+
+        def hide(expression):
+            key = self.expression_key(expression)
+            if key not in hoisted:
+                hoisted[key] = (f'$licm{self.hoisted}', expression)
+                self.hoisted += 1
+            return ('load', ('variable', hoisted[key][0]))
+
+        block = rewrite(block, replace_expression, replace_value)
+        if condition is not None:
+            condition = ('comparison', condition[1], replace_value(condition[2]), replace_value(condition[3]))
+
+        for (name, expression) in hoisted.values():
+            self.memory.add_variable(name, shared=True)
+            self.memory[name].initialized = True
+            self.calculate_expression(expression, self.lineno)
+            self.emit('STORE', self.memory.get_variable(name))
+        return (block, condition)
+
+    # induction variables of FOR loop: addresses of array elements indexed by iterator ('$iv' pointers) and products
+    # of iterator and invariant value ('$iv' variables) take their place in block. They are initialized here and kept
+    # up to date by single addition per iteration. Returns block and instructions updating them
+    def induction_variables(self, block, iterator, step):
+        if 'induction_variables' not in self.optimizations:
+            return (block, [])
+
+        modified = self.aliased(written(block) | {iterator})
+        induced = dict()    # element or product -> hidden name
+        updates = []
+        uses = dict()
+        for (identifier, weight) in indexed(block, iterator):
+            uses[identifier] = uses.get(identifier, 0) + weight
+
+        def element(identifier):
+            # LOAD of address saves computing it (one LOAD and one ADD) at every use, update costs three instructions
+            if uses.get(identifier, 0) <= 3:
+                return identifier
+            array = self.memory.get(identifier[1])
+            if not (isinstance(array, Array) or isinstance(array, Pointer) and array.type == 'array'):
+                return identifier
+            if identifier not in induced:
+                name = f'$iv{self.hoisted}'
+                self.hoisted += 1
+                self.memory.add_pointer(name, 'variable', shared=True)
+                pointer = self.memory[name]
+                pointer.array = identifier[1]
+                self.load_address(identifier)
+                self.emit('STORE', pointer.location)
+                updates.append([('SET', step), ('ADD', pointer.location), ('STORE', pointer.location)])
+                induced[identifier] = name
+            return ('variable', induced[identifier])
+
+        def value(value):
+            if value[0] == 'load':
+                return ('load', element(value[1]))
+            return value
+
+        def expression(expression):
+            if expression[0] in ('number', 'load'):
+                return value(expression)
+            if expression[0] == '*':
+                factor = None
+                if expression[1] == ('load', ('variable', iterator)):
+                    factor = expression[2]
+                elif expression[2] == ('load', ('variable', iterator)):
+                    factor = expression[1]
+                key = self.expression_key(expression)
+                if key in induced:
+                    return ('load', ('variable', induced[key]))
+                if factor is not None and self.increment(factor, modified, step, 0) is not None:
+                    name = f'$iv{self.hoisted}'
+                    self.hoisted += 1
+                    self.memory.add_variable(name, shared=True)
+                    self.memory[name].initialized = True
+                    location = self.memory.get_variable(name)
+                    self.calculate_expression(expression, self.lineno)
+                    self.emit('STORE', location)
+                    updates.append(self.increment(factor, modified, step, location))
+                    induced[key] = name
+                    return ('load', ('variable', name))
+            return (expression[0], value(expression[1]), value(expression[2]))
+
+        block = rewrite(block, expression, value, element)
+        return (block, updates)
+
+    # instructions adding step * factor to product in cell, None when factor changes in loop
+    # or computing product anew is cheaper than update
+    def increment(self, factor, modified, step, cell):
+        if factor[0] == 'number':
+            digits = signed_digits(abs(factor[1]))
+            if chain_cost(digits) + (NEGATION_COST if factor[1] < 0 else 0) <= 2 * LOAD_COST + SET_COST:
+                return None
+            return [('SET', step * factor[1]), ('ADD', cell), ('STORE', cell)]
+        if factor[1][0] != 'variable' or not self.ready(factor[1][1]) or factor[1][1] in modified:
+            return None
+        return [('LOAD', cell), self.direct_operand(factor, 'ADD' if step > 0 else 'SUB'), ('STORE', cell)]
+
+    # variable can be read without diagnostics: initialized variable, active iterator or pointer
+    def ready(self, name):
+        cell = self.memory.get(name)
+        if isinstance(cell, Variable):
+            return cell.initialized
+        if isinstance(cell, Iterator):
+            return cell.active
+        return isinstance(cell, Pointer) and cell.type == 'variable'
+
+    # first check of rotated loop's condition - callers emit it in front of code hoisted out of loop (invariants,
+    # induction variables), so that code runs only when loop does. Returns label it jumps to when loop is skipped
+    def guard_loop(self, condition):
+        if 'loop_rotation' not in self.optimizations:
+            return None
+        exit = Label()
+        self.generate_condition(condition, exit, negation=True)
+        return exit
+
+    # loop testing its condition before every iteration, after 'loop_rotation' the condition is tested once
+    # at the top (unless first check is known to pass, or was already made by guard_loop - exit is its label)
+    # and then at the bottom, branching straight back to the block
+    def gen_loop(self, condition, block, iterator_address = None, step = 0, guarded = True, updates = (), exit = None):
+        block_start = Label()
+        after_block = Label() if exit is None else exit
+
+        if 'loop_rotation' in self.optimizations:
+            if guarded and exit is None:
+                self.generate_condition(condition, after_block, negation=True)
+            self.place(block_start)
+            self.forget()
+            self.known = self.loop_known(block)
+        else:
+            self.place(block_start)
+            self.forget()
+            self.known = self.loop_known(block)
+            self.generate_condition(condition, after_block, negation=True)
+
+        self.loopDepth += 1
+        self.gen_body(block)
+        self.loopDepth -= 1
+        self.forget()
+
+        if iterator_address is not None:
+            self.emit('SET', step)
+            self.emit('ADD', iterator_address)
+            self.emit('STORE', iterator_address)
+            for update in updates:
+                for instruction in update:
+                    self.emit(*instruction)
+
+        if 'loop_rotation' in self.optimizations:
+            self.generate_condition(condition, block_start)
+        else:
+            self.emit('JUMP', block_start)
+        self.place(after_block)
+        self.forget()
 
-        if first_value[0] == 'number':
-            self.code.append(f'SET  {first_value[1]}')
-            self.code.append(f'STORE {TEMP_CELL_C}')
-        else: #first_value[0] == 'load'
-            self.load_value(first_value[1])
-            self.code.append(f'STORE {TEMP_CELL_C}')
-        
-        if second_value[0] == 'number':
-            self.code.append(f'SET  {second_value[1]}')
-            self.code.append(f'STORE {TEMP_CELL_D}')
-        else: #second_value[0] == 'load'
-            self.load_value(second_value[1])
-            self.code.append(f'STORE {TEMP_CELL_D}')
-        
-        if operator == '>':
-            self.code.append(f'LOAD {TEMP_CELL_C}')
-            self.code.append(f'SUB  {TEMP_CELL_D}')
-            self.code.append(f'JPOS 2')
-
-        elif operator == '=':
-            self.code.append(f'LOAD  {TEMP_CELL_C}')
-            self.code.append(f'SUB   {TEMP_CELL_D}')
-            self.code.append(f'JZERO 2')
-
-
-    def simplify_condition(self, condition):
-        operator = condition[1]
-        first_value = condition[2]
-        second_value = condition[3]
-
-        if operator == '=':
-            return condition, False
-        elif operator == '!=':
-            return ('comparison', '=', first_value, second_value), True
-        elif operator == '>':
-            return condition, False
-        elif operator == '<':
-            return ('comparison', '>', second_value, first_value), False
-        elif operator == '>=':
-            return ('comparison', '>', second_value, first_value), True
-        else: # operator == '<='
-            return ('comparison', '>', first_value, second_value), True
 
     # result to accumulator
     def calculate_expression(self, expression, lineno):
@@ -924,7 +1479,7 @@ class Generator:
                 print(f"Warning: Line {lineno}: variable '{expression[1][1]}' may be not initialized")
         
         if expression[0] == "number":
-            self.code.append(f'SET {expression[1]}') # load number
+            self.emit('SET', expression[1]) # load number
 
         elif expression[0] == "load":
             self.load_value(expression[1]) #  load variable value
@@ -949,86 +1504,194 @@ class Generator:
                 else:
                     print(f"Warning: Line {lineno}: variable '{second_arg[1][1]}' may be not initialized")
 
-            # two numbers
-            if first_arg[0] == 'number' and second_arg[0] == 'number':
-                if operation == '+':
-                    result = first_arg[1] + second_arg[1]
-                elif operation == '-':
-                    result = first_arg[1] - second_arg[1]
-                elif operation == '*':
-                    result = first_arg[1] * second_arg[1]
-                elif operation == '/':
-                    if second_arg[1] == 0:
-                        result = 0
-                    else:
-                        result = first_arg[1] // second_arg[1]
-                else: # operation == '%:
-                    if second_arg[1] == 0:
-                        result = 0
-                    else:
-                        result = first_arg[1] % second_arg[1]
+            if self.reuse(expression):
+                return
 
-                self.code.append(f'SET {result}')
+            # two numbers (or variables of known value)
+            (first_literal, second_literal) = (self.literal(first_arg), self.literal(second_arg))
+            if first_literal[0] == 'number' and second_literal[0] == 'number':
+                self.emit('SET', fold(operation, first_literal[1], second_literal[1]))
 
             # at least one variable/array
             else:
 
-                # special cases
-                if (first_arg[0] == 'number' and second_arg[0] == 'load') or (first_arg[0] == 'load' and second_arg[0] == 'number'):
-                    if first_arg[0] == 'number':
-                        num_arg = first_arg
-                        var_arg = second_arg
-                    else:
-                        num_arg = second_arg
-                        var_arg = first_arg
-                        
-                        # efficient division by 2
-                        if num_arg[1] == 2 and operation == '/':
-                            self.load_value(var_arg[1])
-                            self.code.append('HALF')
-                            return
-                    
-
-                    # efficient multiplication by 2
-                    if num_arg[1] == 2 and operation == '*':
-                        self.load_value(var_arg[1])
-                        self.code.append(f'ADD 0')
-                        return
+                # special cases - literal is worth it only here, otherwise loading variable is cheaper than SET
+                if operation in ('*', '/', '%') and self.reduce_strength(operation, first_literal, second_literal):
+                    return
 
                 # load second value
                 if second_arg[0] == 'number':
-                    self.code.append(f'SET {second_arg[1]}')
-                    self.code.append(f'STORE {TEMP_CELL_F}')
+                    self.emit('SET', second_arg[1])
+                    self.emit('STORE', TEMP_CELL_F)
                 else: #second_arg[0] == 'load'
                     self.load_value(second_arg[1])
-                    self.code.append(f'STORE {TEMP_CELL_F}')
+                    self.emit('STORE', TEMP_CELL_F)
                 
                 # load first value
                 if first_arg[0] == 'number':
-                    self.code.append(f'SET {first_arg[1]}')
-                    self.code.append(f'STORE {TEMP_CELL_E}')
+                    self.emit('SET', first_arg[1])
+                    self.emit('STORE', TEMP_CELL_E)
                 else: #first_arg[0] == 'load'
                     self.load_value(first_arg[1])
-                    self.code.append(f'STORE {TEMP_CELL_E}')
+                    self.emit('STORE', TEMP_CELL_E)
 
                 if operation == '+':
-                    self.code.append(f'ADD {TEMP_CELL_F}') # since first still in accu
+                    self.emit('ADD', TEMP_CELL_F) # since first still in accu
                 
                 elif operation == '-':
-                    self.code.append(f'SUB {TEMP_CELL_F}') # since first still in accu
+                    self.emit('SUB', TEMP_CELL_F) # since first still in accu
 
                 elif operation == '*':
-                    self.multiply(factor_address1=TEMP_CELL_E, factor_address2=TEMP_CELL_F)
+                    self.arithmetic('multiply')
+                    self.remember(expression, TEMP_CELL_H, self.names(expression))
 
                 else: # operation == '/' or operation == '%'
+                    self.arithmetic('divmod')
+                    # both results are computed, so pair of '/' and '%' on the same operands needs only one division
+                    names = self.names(expression)
+                    self.remember(('/', first_arg, second_arg), TEMP_CELL_G, names)
+                    self.remember(('%', first_arg, second_arg), TEMP_CELL_H, names)
                     if operation == '/':
-                        self.divide(dividend_address=TEMP_CELL_E, divisor_address=TEMP_CELL_F)
+                        self.emit('LOAD', TEMP_CELL_G)
                     else: # operation == '%'
-                        self.modulo(dividend_address=TEMP_CELL_E, divisor_address=TEMP_CELL_F)
+                        self.emit('LOAD', TEMP_CELL_H)
+
+    # multiply (result to accumulator) or divmod (results to TEMP_CELL_G and TEMP_CELL_H) of TEMP_CELL_E and TEMP_CELL_F -
+    # inlined in loops and in procedures called from loops, elsewhere (and after inline budget is used up) call of
+    # routine emitted once after HALT
+    def arithmetic(self, routine):
+        hot = self.loopDepth >= INLINE_DEPTH or self.entered >= LOOP_WEIGHT ** INLINE_DEPTH
+        if 'runtime_routines' not in self.optimizations or (hot and self.inlined < INLINE_BUDGET):
+            size = len(self.code)
+            getattr(self, routine)(TEMP_CELL_E, TEMP_CELL_F)
+            self.inlined += len(self.code) - size
+            return
+
+        # routine writes temporary cells out of sight of emit
+        self.available = {key: entry for key, entry in self.available.items() if entry[0] > TEMP_CELL_R}
+
+        if routine not in self.routines:
+            self.routines[routine] = [Label(routine), 0, []]
+        self.routines[routine][1] += self.weight
+
+        # same as procedure call, result stays in accumulator
+        return_label = Label()
+        self.emit('SET', return_label)
+        self.emit('STORE', TEMP_CELL_R)
+        self.emit('JUMP', self.routines[routine][0])
+        self.place(return_label)
+        self.routines[routine][2].append((self.code, return_label))
+
+    # routines called from single place (of given units) are inlined there after all, units of shared ones are returned
+    def gen_routines(self, units):
+        shared = []
+        for routine, (label, calls, sites) in self.routines.items():
+            sites = [(code, return_label) for (code, return_label) in sites if any(code is unit[2] for unit in units)]
+            self.weight = calls
+            self.code = []
+            if len(sites) == 1:
+                getattr(self, routine)(TEMP_CELL_E, TEMP_CELL_F)
+                (code, return_label) = sites[0]
+                # call is found by its return label (positions in code change when other calls are replaced):
+                # SET return label, STORE, JUMP routine and return label itself are replaced by body of routine
+                end = next(position for position, item in enumerate(code) if item is return_label)
+                if code[end - 3].operand is not return_label or code[end - 1].operand is not label:
+                    raise Exception(f"call of routine '{routine}' was changed before it was inlined")
+                code[end - 3:end + 1] = self.code
+            elif len(sites) > 1:
+                self.place(label)
+                getattr(self, routine)(TEMP_CELL_E, TEMP_CELL_F)
+                self.emit('RTRN', TEMP_CELL_R)
+                shared.append((routine, label, self.code))
+        self.weight = 1
+        return shared
+
+
+    # multiplication, division and modulo with constant operand computed without multiply/divide/modulo routines;
+    # False when routine should be used. Division and modulo follow floor semantics (as HALF and constant folding)
+    def reduce_strength(self, operation, first_arg, second_arg):
+        if first_arg[0] == 'load' and second_arg[0] == 'number':
+            var_arg = first_arg
+            constant = second_arg[1]
+        elif first_arg[0] == 'number' and second_arg[0] == 'load':
+            if operation != '*':
+                if first_arg[1] == 0: # 0 / x and 0 % x
+                    self.emit('SET', 0)
+                    return True
+                return False
+            var_arg = second_arg
+            constant = first_arg[1]
+        else:
+            return False
+
+        magnitude = abs(constant)
+        power = magnitude.bit_length() - 1
+
+        if operation == '*':
+            if constant == 0:
+                self.emit('SET', 0)
+                return True
+            digits = signed_digits(magnitude)
+            if chain_cost(digits) + (NEGATION_COST if constant < 0 else 0) > MULTIPLY_COST + MULTIPLY_STEP_COST * magnitude.bit_length():
+                return False
+            (address, indirect) = self.value_in_cell(var_arg)
+            for digit in digits[1:]:
+                self.emit('ADD', 0)
+                if digit != 0:
+                    self.emit(('ADD' if digit > 0 else 'SUB') + indirect, address)
+            if constant < 0:
+                self.negate()
+            return True
 
+        if magnitude & (magnitude - 1) != 0:
+            return False    # only powers of two (and zero)
+
+        if operation == '/':
+            if constant == 0:
+                self.emit('SET', 0)
+                return True
+            # floor(x / -2^k) = floor(-x / 2^k)
+            self.load_value(var_arg[1])
+            if constant < 0:
+                self.negate()
+            for _ in range(power):
+                self.emit('HALF')
+            return True
+
+        else: # operation == '%'
+            if magnitude <= 1:
+                self.emit('SET', 0)
+                return True
+            # x % 2^k = x - 2^k * floor(x / 2^k), x % -2^k = x + 2^k * floor(-x / 2^k)
+            (address, indirect) = self.value_in_cell(var_arg)
+            if constant < 0:
+                self.negate()
+            for _ in range(power):
+                self.emit('HALF')
+            for _ in range(power):
+                self.emit('ADD', 0)
+            self.emit('STORE', TEMP_CELL_F)
+            self.emit('LOAD' + indirect, address)
+            self.emit('ADD' if constant < 0 else 'SUB', TEMP_CELL_F)
+            return True
+
+    # loads value to accumulator, returns cell that holds it as well: (address, 'I' when address is pointer's cell else '')
+    def value_in_cell(self, value):
+        self.load_value(value[1])
+        operand = self.direct_operand(value, '')
+        if operand is not None:
+            return (operand[1], operand[0])
+        self.emit('STORE', TEMP_CELL_E)
+        return (TEMP_CELL_E, '')
+
+    # accumulator = -accumulator
+    def negate(self):
+        self.emit('STORE', TEMP_CELL_G)
+        self.emit('SET', 0)
+        self.emit('SUB', TEMP_CELL_G)
 
     # load address to accumulator
-    def load_address(self, memory_cell, temp_address = TEMP_CELL_M):
+    def load_address(self, memory_cell):
         if memory_cell[0] == 'number':
             raise Exception('can not load address of literal')
         elif memory_cell[0] == 'variable' or memory_cell[0] == 'iterator':
@@ -1039,10 +1702,10 @@ class Generator:
 
             # pointers 
             if self.memory.is_pointer(memory_cell[1]):
-                self.code.append(f'LOAD {address}')
+                self.emit('LOAD', address)
                 return
             
-            self.code.append(f'SET {address}')
+            self.emit('SET', address)
         else: # memory_cell[0] == 'array'
             index = memory_cell[2]
 
@@ -1058,97 +1721,55 @@ class Generator:
                 if var in self.memory and isinstance(self.memory[var], Iterator) and not self.memory[var].active:
                     print(f"Error: Line {self.lineno}: trying to access local iterator '{var}' that went out out scope")
                     self.errorMode = True
-            
+            index = self.known_index(memory_cell[1], index)
             
             # pointer to array
             if self.memory.is_array_pointer(memory_cell[1]):
-                
-                pointer_address = self.memory.get_variable(memory_cell[1])
-
-                if index[0] == 'number':
-                    # load value from first cell of array (lower_bound)
-                    self.code.append(f'LOADI {pointer_address}')
-                    self.code.append(f'STORE {temp_address}')
-                    # load index value
-                    self.load_value(index)
-                    # substract lower bound
-                    self.code.append(f'SUB {temp_address}')
-                    self.code.append(f'STORE {temp_address}')
-                    # add array's start address + 1
-                    self.code.append(f'SET 1')
-                    self.code.append(f'ADD {pointer_address}')
-                    self.code.append(f'ADD {temp_address}')
-
-                else: # index[0] == 'load'
-
-                    # load value from first cell of array (lower_bound)
-                    self.code.append(f'LOADI {pointer_address}')
-                    self.code.append(f'STORE {temp_address}')
-
-                    # index is pointer
-                    if self.memory.is_pointer(index[1]):
-                        self.load_value((self.memory.get_pointer_type(index[1]), index[1]))
-                        # substract lower bound                        
-                        self.code.append(f'SUB {temp_address}')
-                        self.code.append(f'STORE {temp_address}')
-                        # add array's start address + 1
-                        self.code.append(f'SET 1')
-                        self.code.append(f'ADD {pointer_address}')
-                        self.code.append(f'ADD {temp_address}')
-
-                    # simple variable / iterator
-                    else:
-                        self.load_value((self.memory.get_type(index[1]), index[1]))
-                        # substract lower bound                        
-                        self.code.append(f'SUB {temp_address}')
-                        self.code.append(f'STORE {temp_address}')
-                        # add array's start address + 1
-                        self.code.append(f'SET 1')
-                        self.code.append(f'ADD {pointer_address}')
-                        self.code.append(f'ADD {temp_address}')
+                # pointer holds address of element 0
+                self.load_index(index)
+                self.emit('ADD', self.memory.get_variable(memory_cell[1]))
 
             # local array
             else:
                 if index[0] == 'number':
                     address = self.memory.get_array_at_index(memory_cell[1], index[1])
-                    self.code.append(f'SET {address}')
+                    self.emit('SET', address)
                 else: # index[0] == 'load'
-
-                    if self.memory.is_pointer(index[1]):
-                        array_address = self.memory.get_array_at_index(memory_cell[1], 0, get_array_start_location=True)
-                        # load and store lower bound of array
-                        self.code.append(f'LOAD {array_address}')
-                        self.code.append(f'STORE {temp_address}')
-                        # load value of 'offset value' pointer
-                        self.load_value((self.memory.get_pointer_type(index[1]), index[1]))
-                        # substract lower bound
-                        self.code.append(f'SUB {temp_address}')
-                        self.code.append(f'STORE {temp_address}')
-                        # add base address + 1
-                        self.code.append(f'SET {array_address + 1}')
-                        self.code.append(f'ADD {temp_address}')
-                    else:
-                        # get start address of array in memory
-                        array_address = self.memory.get_array_at_index(memory_cell[1], 0,  get_array_start_location=True)
-                        # first load and store array's !lower bound value!
-                        self.code.append(f'LOAD {array_address}')
-                        self.code.append(f'STORE {temp_address}')
-                        # walkaround to get value of index (it's just PID, so we take it from memory)
-                        memory_cell = (self.memory.get_type(index[1]), index[1])
-                        self.load_value(memory_cell)
-                        # substract lower bound
-                        self.code.append(f'SUB {temp_address}')
-                        self.code.append(f'STORE {temp_address}')
-                        # add base address + 1
-                        self.code.append(f'SET {array_address + 1}')
-                        self.code.append(f'ADD {temp_address}')
-                        # load proper address to acc
+                    self.element_address(self.memory.get_array(memory_cell[1]), index)
+
+    # value of index (literal or name of variable, iterator or pointer) to accumulator
+    def load_index(self, index):
+        if index[0] == 'number':
+            self.emit('SET', index[1])
+        elif self.memory.is_pointer(index[1]):
+            self.load_value((self.memory.get_pointer_type(index[1]), index[1]))
+        else:
+            self.load_value((self.memory.get_type(index[1]), index[1]))
+
+    # index of local array replaced by its known value, as long as it is in bounds - address is fixed then
+    def known_index(self, name, index):
+        array = self.memory.get(name)
+        if index[0] == 'load' and index[1] in self.known and isinstance(array, Array) \
+                and array.lower_bound <= self.known[index[1]] <= array.upper_bound:
+            return ('number', self.known[index[1]])
+        return index
+
+    # address of element of local array indexed by variable, iterator or pointer: address of element 0 is known
+    # at compile time, so only index is added to it
+    def element_address(self, array, index):
+        operand = self.direct_operand(('load', ('variable', index[1])), 'ADD')
+        if operand is None:
+            self.load_index(index)
+            self.emit('STORE', TEMP_CELL_M)
+            operand = ('ADD', TEMP_CELL_M)
+        self.emit('SET', array.base())
+        self.emit(*operand)
 
     
     # load value from memory to accumulator
-    def load_value(self, memory_cell, temporary_address = TEMP_CELL_V):
+    def load_value(self, memory_cell):
         if memory_cell[0] == 'number':
-            self.code.append(f'SET {memory_cell[1]}')
+            self.emit('SET', memory_cell[1])
         elif memory_cell[0] == 'variable' or memory_cell[0] == 'iterator':
             address = self.memory.get_variable(memory_cell[1])
 
@@ -1157,11 +1778,11 @@ class Generator:
 
             # pointer 
             if self.memory.is_pointer(memory_cell[1]):
-                self.code.append(f'LOADI {address}')
+                self.emit('LOADI', address)
                 return
 
             # non pointer
-            self.code.append(f'LOAD {address}')
+            self.emit('LOAD', address)
         else: # memory_cell[0] == 'array'
             index = memory_cell[2]
 
@@ -1178,101 +1799,26 @@ class Generator:
                     print(f"Error: Line {self.lineno}: trying to access local iterator '{var}' that went out out scope")
                     self.errorMode = True
             
+            if self.reuse(memory_cell):
+                return
+            index = self.known_index(memory_cell[1], index)
+
             # pointer to array
             if self.memory.is_array_pointer(memory_cell[1]):
-
-                pointer_address = self.memory.get_variable(memory_cell[1])
-
-                if index[0] == 'number':
-                    # first load and store array's !lower bound value!
-                    self.code.append(f'LOADI {pointer_address}')
-                    self.code.append(f'STORE {temporary_address}')
-                    self.load_value(index)
-                    # substract lower bond
-                    self.code.append(f'SUB {temporary_address}')
-                    self.code.append(f'STORE {temporary_address}')
-                    # add array address + 1
-                    self.code.append(f'SET 1')
-                    self.code.append(f'ADD {temporary_address}')
-                    self.code.append(f'STORE {temporary_address}')
-                    self.code.append(f'LOAD {pointer_address}') # array address
-                    self.code.append(f'ADD {temporary_address}')
-                    self.code.append(f'LOADI 0')
-                
-                else: # index[0] == 'load'
-                    # index is pointer
-                    if self.memory.is_pointer(index[1]):
-                        # first load and store array's !lower bound value!
-                        self.code.append(f'LOADI {pointer_address}')
-                        self.code.append(f'STORE {temporary_address}')
-                        # load value of offset value pointer
-                        self.load_value((self.memory.get_pointer_type(index[1]), index[1]))
-                        # substract lower bond
-                        self.code.append(f'SUB {temporary_address}')
-                        self.code.append(f'STORE {temporary_address}')
-                        # add array address + 1
-                        self.code.append(f'SET 1')
-                        self.code.append(f'ADD {temporary_address}')
-                        self.code.append(f'STORE {temporary_address}')
-                        self.code.append(f'LOAD {pointer_address}') # array address
-                        self.code.append(f'ADD {temporary_address}')
-                        self.code.append(f'LOADI 0')
-                    else: # simple variable / iterator
-                        # first load and store array's !lower bound value!
-                        self.code.append(f'LOADI {pointer_address}')
-                        self.code.append(f'STORE {temporary_address}')
-                        # load value of offset value pointer
-                        self.load_value((self.memory.get_type(index[1]), index[1]))
-                        # substract lower bond
-                        self.code.append(f'SUB {temporary_address}')
-                        self.code.append(f'STORE {temporary_address}')
-                        # add array address + 1
-                        self.code.append(f'SET 1')
-                        self.code.append(f'ADD {temporary_address}')
-                        self.code.append(f'STORE {temporary_address}')
-                        self.code.append(f'LOAD {pointer_address}') # array address
-                        self.code.append(f'ADD {temporary_address}')
-                        self.code.append(f'LOADI 0')
+                # pointer holds address of element 0
+                self.load_index(index)
+                self.emit('ADD', self.memory.get_variable(memory_cell[1]))
+                self.emit('LOADI', 0)
             
             else: # local array
                 if index[0] == 'number':
                     #  indexes by literal value are handled by function -> no need for manual work
                     address = self.memory.get_array_at_index(memory_cell[1], index[1])
-                    self.code.append(f'LOAD {address}')
+                    self.emit('LOAD', address)
                 else: # index[0] == 'load'
-
-                    array_address = self.memory.get_array_at_index(memory_cell[1], 0, get_array_start_location=True)
-                    
-                    # pointer
-                    if self.memory.is_pointer(index[1]):
-                        # first load and store array's !lower bound value!
-                        self.code.append(f'LOAD {array_address}')
-                        self.code.append(f'STORE {temporary_address}')
-                        # load value of 'offset value' pointer
-                        self.load_value((self.memory.get_pointer_type(index[1]), index[1]))
-                        # substract by !lower bound value!
-                        self.code.append(f'SUB {temporary_address}')
-                        self.code.append(f'STORE {temporary_address}')
-                        # then add array's start address + 1
-                        self.code.append(f'SET {array_address + 1}')
-                        self.code.append(f'ADD {temporary_address}')
-                        # load value from address stored in acc (like pointer)
-                        self.code.append(f'LOADI 0')
-                    
-                    else: # simple variable / iterator                        
-                        # first load and store array's !lower bound value!
-                        self.code.append(f'LOAD {array_address}')
-                        self.code.append(f'STORE {temporary_address}')
-                        # walkaround to get !value of index! (it's just PID, so we take it from memory)
-                        self.load_value((self.memory.get_type(index[1]), index[1]), temporary_address=TEMP_CELL_V2)
-                        # substract by !lower bound value!
-                        self.code.append(f'SUB {temporary_address}')
-                        self.code.append(f'STORE {temporary_address}')
-                        # then add array's start address + 1
-                        self.code.append(f'SET {array_address + 1}')
-                        self.code.append(f'ADD {temporary_address}')
-                        # load value from address stored in acc (like pointer)
-                        self.code.append(f'LOADI 0')
+                    self.element_address(self.memory.get_array(memory_cell[1]), index)
+                    # load value from address stored in acc (like pointer)
+                    self.emit('LOADI', 0)
 
 
 
@@ -0,0 +1,31 @@
+class Instruction:
+    __slots__ = ('opcode', 'operand')
+
+    def __init__(self, opcode, operand = None):
+        self.opcode = opcode
+        self.operand = operand
+
+    def __repr__(self):
+        if self.operand is None:
+            return self.opcode
+        return f'{self.opcode} {self.operand}'
+
+
+# text form is built only once, when program is written out
+def to_text(code):
+    return ''.join([f'{instruction}\n' for instruction in code])
+
+
+class Label:
+    __slots__ = ('name',)
+    opcode = 'LABEL'    # labels live in code as markers and take no space after assembly
+
+    def __init__(self, name = ''):
+        self.name = name
+
+    def __repr__(self):
+        return f'{self.name or hex(id(self))}:'
+
+
+JUMPS = ('JUMP', 'JPOS', 'JZERO', 'JNEG')
+
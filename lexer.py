@@ -90,8 +90,12 @@ class MyLexer(Lexer):
         t.value = int(t.value)
         return t
 
+    def __init__(self):
+        self.failed = False     # unrecognized symbol was skipped - program can't be compiled
+
     def error(self, t):
         print(f"Line {self.lineno + 1}: Unrecognized symbol: {t.value[0]}")
+        self.failed = True
         self.index += 1
 
 
@@ -0,0 +1,93 @@
+from instructions import Instruction, Label, JUMPS
+
+
+# relocatable piece of program - procedure, main or shared runtime routine - assembled on its own.
+# Labels placed in its code are resolved when it is assembled: jumps inside unit get relative offsets, return
+# addresses (SET of label) positions counted from start of unit. The only symbol unit exports is its entry, every
+# place that depends on where unit is laid out is in relocation table:
+# (offset, None) - position inside unit, start of unit is added to it,
+# (offset, symbol) - entry of other unit, relative to the instruction for jumps, absolute for anything else
+class Unit:
+    def __init__(self, name, symbol, code, entry, relocations):
+        self.name = name
+        self.symbol = symbol            # label of entry, the only one other units can refer to
+        self.code = code                # instructions without labels
+        self.entry = entry              # offset of entry in code
+        self.relocations = relocations
+
+    # symbols of other units it refers to
+    def references(self):
+        return [symbol for (_, symbol) in self.relocations if symbol is not None]
+
+    def __repr__(self):
+        return f'Unit: {self.name}, instructions: {len(self.code)}, relocations: {len(self.relocations)}'
+
+
+# unit from code with labels; symbol has to be placed in it, labels that are used but not placed are symbols of
+# other units
+def assemble(name, symbol, code):
+    positions = {}
+    position = 0
+    for instruction in code:
+        if isinstance(instruction, Label):
+            positions[instruction] = position
+        else:
+            position += 1
+    if symbol not in positions:
+        raise Exception(f"entry '{symbol.name}' of unit '{name}' is not placed in it")
+
+    assembled = []
+    relocations = []
+    for instruction in code:
+        if isinstance(instruction, Label):
+            continue
+        operand = instruction.operand
+        if isinstance(operand, Label):
+            if operand not in positions:
+                relocations.append((len(assembled), operand))
+                operand = 0
+            elif instruction.opcode in JUMPS:
+                operand = positions[operand] - len(assembled)
+            else:
+                relocations.append((len(assembled), None))
+                operand = positions[operand]
+        assembled.append(Instruction(instruction.opcode, operand))
+    return Unit(name, symbol, assembled, positions[symbol], relocations)
+
+
+# lays out entry unit first (execution starts with its first instruction, no jump to it is needed) and every unit
+# reachable from it through relocations, in order of given units - units nobody refers to are dropped.
+# Relocations are patched in copy of code, units themselves stay as they were assembled
+def link(entry, units):
+    owners = {unit.symbol: unit for unit in units}
+    linked = {id(entry)}
+    pending = [entry]
+    while pending:
+        unit = pending.pop()
+        for symbol in unit.references():
+            if symbol not in owners:
+                raise Exception(f"unit '{unit.name}' references undefined symbol '{symbol.name}'")
+            if id(owners[symbol]) not in linked:
+                linked.add(id(owners[symbol]))
+                pending.append(owners[symbol])
+    layout = [entry] + [unit for unit in units if unit is not entry and id(unit) in linked]
+
+    bases = dict()
+    base = 0
+    for unit in layout:
+        bases[id(unit)] = base
+        base += len(unit.code)
+
+    code = []
+    for unit in layout:
+        base = bases[id(unit)]
+        patched = [Instruction(instruction.opcode, instruction.operand) for instruction in unit.code]
+        for (offset, symbol) in unit.relocations:
+            instruction = patched[offset]
+            if symbol is None:
+                instruction.operand += base
+            else:
+                target = bases[id(owners[symbol])] + owners[symbol].entry
+                instruction.operand = target - (base + offset) if instruction.opcode in JUMPS else target
+        code.extend(patched)
+    return code
@@ -4,10 +4,15 @@ from generator import Generator
 
 class MyParser(Parser):
     tokens = MyLexer.tokens
-    code_generator = Generator()
-    
+
+    # every parser generates code with its own generator - programs parsed one after another don't share code
+    def __init__(self, code_generator = None):
+        self.code_generator = code_generator if code_generator is not None else Generator()
+
     @_('procedures main')
     def program_all(self, p):
+        self.code_generator.count_calls(p.procedures, p.main)
+        self.code_generator.reserve(p.procedures, p.main)
         for procedure in p.procedures:
             self.code_generator.gen_procedure(head=procedure[0], declarations=procedure[1], commands=procedure[2])
         self.code_generator.gen(*p.main)
@@ -215,6 +220,7 @@ class MyParser(Parser):
 
 
     def error(self, p):
+        self.code_generator.errorMode = True
         if p:
             print(f"Syntax error at {p.type} ({p.value})")
         else:
@@ -0,0 +1,224 @@
+from instructions import Instruction, Label, JUMPS
+from vm import COSTS
+
+# instructions whose only effect is new value of accumulator
+ACCUMULATOR_ONLY = ('LOAD', 'LOADI', 'SET', 'ADD', 'SUB', 'ADDI', 'SUBI', 'HALF')
+# control never falls through to next instruction
+UNCONDITIONAL = ('JUMP', 'HALT', 'RTRN')
+
+
+def overwrites_accumulator(instruction):
+    if instruction.opcode == 'SET':
+        return True
+    if instruction.opcode == 'LOAD' or instruction.opcode == 'LOADI':
+        return instruction.operand != 0   # operand 0 is accumulator itself
+    if instruction.opcode == 'GET':
+        return instruction.operand == 0
+    return False
+
+
+def first_instruction(code, index):
+    while index < len(code) and isinstance(code[index], Label):
+        index += 1
+    return index
+
+
+# every rule gets code, position and Context built from that code, returns (number of consumed instructions, replacement)
+# or None if it doesn't match
+
+def store_load(code, index, context):
+    # STORE x; LOAD x -> STORE x
+    if index + 1 < len(code):
+        a, b = code[index], code[index + 1]
+        if a.opcode == 'STORE' and b.opcode == 'LOAD' and a.operand == b.operand:
+            return 2, [a]
+    return None
+
+
+def load_store(code, index, context):
+    # LOAD x; STORE x -> LOAD x
+    if index + 1 < len(code):
+        a, b = code[index], code[index + 1]
+        if a.opcode == 'LOAD' and b.opcode == 'STORE' and a.operand == b.operand:
+            return 2, [a]
+    return None
+
+
+def dead_accumulator(code, index, context):
+    # value computed to accumulator is overwritten before it is read, e.g. LOAD x; SET 5 -> SET 5
+    if index + 1 < len(code):
+        a, b = code[index], code[index + 1]
+        if a.opcode in ACCUMULATOR_ONLY and not isinstance(b, Label) and overwrites_accumulator(b):
+            return 2, [b]
+    return None
+
+
+def known_zero(code, index, context):
+    # LOAD x; SUB x -> SUB 0 (zero), SUB 0; ADD x -> LOAD x
+    if index + 1 < len(code):
+        a, b = code[index], code[index + 1]
+        if a.opcode == 'LOAD' and b.opcode == 'SUB' and a.operand == b.operand:
+            return 2, [Instruction('SUB', 0)]
+        if a.opcode == 'SUB' and a.operand == 0 and b.opcode == 'ADD' and b.operand != 0:
+            return 2, [Instruction('LOAD', b.operand)]
+    return None
+
+
+def jump_chain(code, index, context):
+    # jump to another JUMP goes straight to its target
+    instruction = code[index]
+    if instruction.opcode in JUMPS and instruction.operand in context.targets:
+        target = instruction.operand
+        visited = {target}
+        while True:
+            next = context.targets.get(target)
+            if next is None or next.opcode != 'JUMP':
+                break
+            if next.operand in visited: # JUMPs forming a cycle (endless loop) are left alone
+                return None
+            target = next.operand
+            visited.add(target)
+        if target is not instruction.operand:
+            return 1, [Instruction(instruction.opcode, target)]
+    return None
+
+
+def jump_to_next(code, index, context):
+    # jump to label placed right after it, e.g. JUMP over empty ELSE block
+    instruction = code[index]
+    if instruction.opcode in JUMPS:
+        position = index + 1
+        while position < len(code) and isinstance(code[position], Label):
+            if code[position] is instruction.operand:
+                return 1, []
+            position += 1
+    return None
+
+
+def unreachable(code, index, context):
+    # nothing after unconditional jump is executed until some label that is jumped to
+    instruction = code[index]
+    if instruction.opcode in UNCONDITIONAL:
+        position = index + 1
+        while position < len(code) and not (isinstance(code[position], Label) and code[position] in context.referenced):
+            position += 1
+        if position > index + 1:
+            return position - index, [instruction]
+    return None
+
+
+def unused_label(code, index, context):
+    # label nobody jumps to only splits windows of other rules
+    if isinstance(code[index], Label) and code[index] not in context.referenced:
+        return 1, []
+    return None
+
+
+RULES = {
+    'store_load': store_load,
+    'load_store': load_store,
+    'dead_accumulator': dead_accumulator,
+    'known_zero': known_zero,
+    'jump_chain': jump_chain,
+    'jump_to_next': jump_to_next,
+    'unreachable': unreachable,
+    'unused_label': unused_label,
+}
+
+# opcodes of instruction at which rule can match (labels have opcode 'LABEL')
+TRIGGERS = {
+    'store_load': ('STORE',),
+    'load_store': ('LOAD',),
+    'dead_accumulator': ACCUMULATOR_ONLY,
+    'known_zero': ('LOAD', 'SUB'),
+    'jump_chain': JUMPS,
+    'jump_to_next': JUMPS,
+    'unreachable': UNCONDITIONAL,
+    'unused_label': ('LABEL',),
+}
+
+
+class Context:
+    def __init__(self, code, exported = ()):
+        self.referenced = set(exported)     # labels used as operand (jumps and return addresses) or by other units
+        self.uses = {label: 1 for label in exported}    # label -> number of such uses
+        self.targets = dict()       # label -> first instruction after it (when pass began)
+        for index, instruction in enumerate(code):
+            if isinstance(instruction, Label):
+                position = first_instruction(code, index)
+                self.targets[instruction] = code[position] if position < len(code) else None
+        self.add(code)
+
+    # keeps referenced labels up to date when rule replaces instructions
+    def add(self, code):
+        for instruction in code:
+            if not isinstance(instruction, Label) and isinstance(instruction.operand, Label):
+                self.uses[instruction.operand] = self.uses.get(instruction.operand, 0) + 1
+                self.referenced.add(instruction.operand)
+
+    def remove(self, code):
+        for instruction in code:
+            if not isinstance(instruction, Label) and isinstance(instruction.operand, Label):
+                self.uses[instruction.operand] -= 1
+                if self.uses[instruction.operand] == 0:
+                    self.referenced.discard(instruction.operand)
+
+
+class Statistics:
+    def __init__(self):
+        self.applied = dict()   # rule -> [times applied, instructions removed, cost saved]
+
+    def add(self, rule, removed, added):
+        entry = self.applied.setdefault(rule, [0, 0, 0])
+        entry[0] += 1
+        entry[1] += sum(1 for instruction in removed if not isinstance(instruction, Label)) \
+                  - sum(1 for instruction in added if not isinstance(instruction, Label))
+        entry[2] += cost(removed) - cost(added)
+
+    def __repr__(self):
+        lines = [f'{"rule":<18} {"applied":>8} {"removed":>8} {"saved cost":>11}']
+        for rule, (applied, removed, saved) in self.applied.items():
+            lines.append(f'{rule:<18} {applied:>8} {removed:>8} {saved:>11}')
+        return '\n'.join(lines)
+
+
+def cost(code):
+    return sum(COSTS[instruction.opcode] for instruction in code if not isinstance(instruction, Label))
+
+
+# applies rules in order of table at every position, until none of them matches anywhere;
+# saved cost is static - cost of a single execution of every removed instruction.
+# Exported labels (entry of unit) are kept as if they were jumped to from code outside.
+# Replacement is tried again together with instruction before it (rules look at most one instruction back over
+# labels), so a pass leaves little for the next one - only labels that lost their last jump behind the position
+def optimize(code, rules = RULES, statistics = None, exported = ()):
+    triggered = dict()  # opcode -> rules in order of table
+    for name, rule in rules.items():
+        for opcode in TRIGGERS[name]:
+            triggered.setdefault(opcode, []).append((name, rule))
+
+    code = list(code)
+    changed = True
+    while changed:
+        changed = False
+        context = Context(code, exported)
+        index = 0
+        while index < len(code):
+            for name, rule in triggered.get(code[index].opcode, ()):
+                match = rule(code, index, context)
+                if match is not None:
+                    consumed, replacement = match
+                    if statistics is not None:
+                        statistics.add(name, code[index:index + consumed], replacement)
+                    context.remove(code[index:index + consumed])
+                    context.add(replacement)
+                    code[index:index + consumed] = replacement
+                    changed = True
+                    # back to previous instruction (over labels) - its window now reaches replacement
+                    index = max(index - 1, 0)
+                    while index > 0 and isinstance(code[index], Label):
+                        index -= 1
+                    break
+            else:
+                index += 1
+    return code
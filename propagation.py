@@ -0,0 +1,109 @@
+# forward constant propagation over command lists (as produced by parser)
+#
+# known: name -> literal value of scalar variable at some point of program. Name that is missing is not known
+# to be constant (bottom of lattice). Only names from 'tracked' (plain variables, not pointers nor iterators)
+# are followed - nothing else can be written to them except commands of current procedure.
+
+
+# arithmetic of language: division rounded down, remainder has sign of divisor, both are 0 for divisor 0
+def fold(operation, a, b):
+    if operation == '+':
+        return a + b
+    elif operation == '-':
+        return a - b
+    elif operation == '*':
+        return a * b
+    elif b == 0:
+        return 0
+    elif operation == '/':
+        return a // b
+    else: # operation == '%'
+        return a % b
+
+
+def compare(operator, a, b):
+    return {'=': a == b, '!=': a != b, '>': a > b, '<': a < b, '>=': a >= b, '<=': a <= b}[operator]
+
+
+# literal value of ('number', n) or ('load', ('variable', name)), None when it isn't known
+def value_of(value, known):
+    if value[0] == 'number':
+        return value[1]
+    if value[1][0] == 'variable':
+        return known.get(value[1][1])
+    return None
+
+
+def evaluate(expression, known):
+    if expression[0] in ('number', 'load'):
+        return value_of(expression, known)
+    a = value_of(expression[1], known)
+    b = value_of(expression[2], known)
+    if a is None or b is None:
+        return None
+    return fold(expression[0], a, b)
+
+
+# True / False when outcome of condition is known, None otherwise
+def outcome(condition, known):
+    a = value_of(condition[2], known)
+    b = value_of(condition[3], known)
+    if a is None or b is None:
+        return None
+    return compare(condition[1], a, b)
+
+
+# values known on both incoming paths
+def meet(a, b):
+    return {name: value for name, value in a.items() if b.get(name) == value}
+
+
+# values known at loop head: on entry and after every iteration (iterated until back edge doesn't change them)
+def loop_head(known, block, tracked):
+    head = known
+    while True:
+        after = meet(known, transfer(block, head, tracked))
+        if after == head:
+            return head
+        head = after
+
+
+def transfer(commands, known, tracked):
+    known = dict(known)
+    for command in commands:
+        if command[0] == 'assign':
+            target = command[1]
+            if target[0] == 'variable' and target[1] in tracked:
+                value = evaluate(command[2][1], known)
+                if value is None:
+                    known.pop(target[1], None)
+                else:
+                    known[target[1]] = value
+
+        elif command[0] == 'read':
+            known.pop(command[1][1], None)
+
+        elif command[0] == 'call':
+            # procedure may write every argument
+            for arg in command[1][1]:
+                known.pop(arg, None)
+
+        elif command[0] == 'ifelse':
+            taken = outcome(command[1], known)
+            if taken is None:
+                known = meet(transfer(command[2], known, tracked), transfer(command[3], known, tracked))
+            else:
+                known = transfer(command[2] if taken else command[3], known, tracked)
+
+        elif command[0] == 'while':
+            # loop is left when condition is checked - at loop head
+            if outcome(command[1], known) is not False:
+                known = loop_head(known, command[2], tracked)
+
+        elif command[0] == 'repeat':
+            known = transfer(command[2], loop_head(known, command[2], tracked), tracked)
+
+        elif command[0] == 'for_to' or command[0] == 'for_downto':
+            known = loop_head(known, command[4], tracked)
+
+    return known
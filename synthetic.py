@@ -0,0 +1,194 @@
+import argparse
+import contextlib
+import io
+import random
+import time
+import tracemalloc
+
+from lexer import MyLexer
+from parser import MyParser
+from generator import Generator
+
+AXES = ('procedures', 'statements', 'depth', 'arrays')
+
+
+def identifier(prefix, number):
+    # pidentifier is [_a-z]+, so numbers are written with letters
+    letters = ''
+    while True:
+        letters = chr(ord('a') + number % 26) + letters
+        number = number // 26
+        if number == 0:
+            return f'{prefix}{letters}'
+
+
+class ProgramBuilder:
+    def __init__(self, procedures=4, statements=20, depth=2, arrays=1, seed=0):
+        self.procedures = procedures
+        self.statements = statements
+        self.depth = depth
+        self.arrays = arrays
+        self.random = random.Random(seed)
+        self.lines = []
+
+    def build(self):
+        for number in range(self.procedures):
+            self.procedure(number)
+        self.main()
+        return '\n'.join(self.lines) + '\n'
+
+    def emit(self, indent, line):
+        self.lines.append('  ' * indent + line)
+
+    def procedure(self, number):
+        # every procedure gets the array and scalars by reference and passes them further down the chain
+        head = ', '.join([f'T {identifier("t", i)}' for i in range(self.arrays)] + ['n', 'x'])
+        self.emit(0, f'PROCEDURE {identifier("p", number)}({head}) IS')
+        locals = ['v', 'w'] + [f'{identifier("b", i)}[0:15]' for i in range(self.arrays)]
+        self.emit(1, ', '.join(locals))
+        self.emit(0, 'BEGIN')
+        self.emit(1, 'v := n;')
+        self.emit(1, 'w := x;')
+        scalars = ['n', 'x', 'v', 'w']
+        arrays = [identifier('t', i) for i in range(self.arrays)] + [identifier('b', i) for i in range(self.arrays)]
+        self.body(1, self.statements, self.depth, scalars, arrays, [])
+        if number > 0:
+            self.call(1, number - 1, [identifier('t', i) for i in range(self.arrays)], ['v', 'x'])
+        self.emit(0, 'END')
+        self.emit(0, '')
+
+    def main(self):
+        declarations = ['n', 'x', 'v', 'w'] + [f'{identifier("a", i)}[0:15]' for i in range(max(self.arrays, 1))]
+        self.emit(0, 'PROGRAM IS')
+        self.emit(1, ', '.join(declarations))
+        self.emit(0, 'BEGIN')
+        self.emit(1, 'READ n;')
+        self.emit(1, 'x := 1;')
+        self.emit(1, 'v := n;')
+        self.emit(1, 'w := 0;')
+        arrays = [identifier('a', i) for i in range(max(self.arrays, 1))]
+        self.body(1, self.statements, self.depth, ['n', 'x', 'v', 'w'], arrays, [])
+        if self.procedures > 0:
+            self.call(1, self.procedures - 1, arrays[:self.arrays], ['n', 'x'])
+        self.emit(1, 'WRITE x;')
+        self.emit(0, 'END')
+
+    def call(self, indent, number, arrays, scalars):
+        self.emit(indent, f'{identifier("p", number)}({", ".join(arrays + scalars)});')
+
+    def body(self, indent, statements, depth, scalars, arrays, iterators):
+        count = 0
+        while count < statements:
+            kind = self.random.random()
+            if depth > 0 and (count == 0 or kind < 0.15):   # first statement opens the nest, so depth is always reached
+                iterator = identifier('i', len(iterators))
+                self.emit(indent, f'FOR {iterator} FROM 0 TO 15 DO')
+                inner = max(1, statements // 4)
+                self.body(indent + 1, inner, depth - 1, scalars, arrays, iterators + [iterator])
+                self.emit(indent, 'ENDFOR')
+                count += inner + 1
+            elif depth > 0 and kind < 0.25:
+                self.emit(indent, f'IF {self.value(scalars, iterators)} > {self.value(scalars, iterators)} THEN')
+                inner = max(1, statements // 6)
+                self.body(indent + 1, inner, depth - 1, scalars, arrays, iterators)
+                self.emit(indent, 'ELSE')
+                self.body(indent + 1, inner, depth - 1, scalars, arrays, iterators)
+                self.emit(indent, 'ENDIF')
+                count += 2 * inner + 1
+            elif arrays and iterators and kind < 0.55:
+                array = self.random.choice(arrays)
+                self.emit(indent, f'{array}[{self.random.choice(iterators)}] := {self.expression(scalars, iterators)};')
+                count += 1
+            else:
+                target = self.random.choice(scalars[2:] if len(scalars) > 2 else scalars)
+                self.emit(indent, f'{target} := {self.expression(scalars, iterators)};')
+                count += 1
+
+    def value(self, scalars, iterators):
+        if self.random.random() < 0.3:
+            return str(self.random.randint(0, 100))
+        return self.random.choice(scalars + iterators)
+
+    def expression(self, scalars, iterators):
+        operator = self.random.choice(['+', '-', '*', '/', '%', ''])
+        if operator == '':
+            return self.value(scalars, iterators)
+        return f'{self.value(scalars, iterators)} {operator} {self.value(scalars, iterators)}'
+
+
+class TimedGenerator(Generator):
+    def __init__(self):
+        super().__init__()
+        self.time = 0.0
+
+    def gen_procedure(self, head, declarations, commands):
+        start = time.perf_counter()
+        super().gen_procedure(head, declarations, commands)
+        self.time += time.perf_counter() - start
+
+    def gen(self, declarations, commands):
+        start = time.perf_counter()
+        super().gen(declarations, commands)
+        self.time += time.perf_counter() - start
+
+
+def measure(source_code):
+    lexer = MyLexer()
+    parser = MyParser(TimedGenerator())
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        tokens = list(lexer.tokenize(source_code))
+        tokenize_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        parser.parse(iter(tokens))
+        parse_time = time.perf_counter() - start - parser.code_generator.time
+
+    return {
+        'tokens': len(tokens),
+        'tokenize': tokenize_time,
+        'parse': parse_time,
+        'gen': parser.code_generator.time,
+        'instructions': len(parser.code_generator.code),
+    }
+
+
+def measure_memory(source_code):
+    lexer = MyLexer()
+    parser = MyParser(Generator())
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        tracemalloc.start()
+        parser.parse(lexer.tokenize(source_code))
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return peak
+
+
+if __name__ == '__main__':
+    arguments = argparse.ArgumentParser(description='generate synthetic programs and measure compile time of every phase')
+    arguments.add_argument('--procedures', type=int, default=4)
+    arguments.add_argument('--statements', type=int, default=20, help='statements per procedure body')
+    arguments.add_argument('--depth', type=int, default=2, help='maximal nesting of loops and conditions')
+    arguments.add_argument('--arrays', type=int, default=1, help='arrays passed through procedure call chain')
+    arguments.add_argument('--seed', type=int, default=0)
+    arguments.add_argument('--axis', choices=AXES, default='statements', help='parameter scaled by --values')
+    arguments.add_argument('--values', default='25,50,100,200,400', help='comma separated sizes of scaled parameter')
+    arguments.add_argument('--emit', metavar='FILE', help='only write program with given parameters to FILE')
+    options = arguments.parse_args()
+
+    parameters = {axis: getattr(options, axis) for axis in AXES}
+
+    if options.emit:
+        with open(options.emit, 'w') as output_file:
+            output_file.write(ProgramBuilder(seed=options.seed, **parameters).build())
+        exit(0)
+
+    print(f'{options.axis:>12} {"lines":>8} {"tokens":>8} {"tokenize[s]":>12} {"parse[s]":>10} {"gen[s]":>10} {"peak[KiB]":>10} {"instructions":>13}')
+    for value in [int(value) for value in options.values.split(',')]:
+        parameters[options.axis] = value
+        source_code = ProgramBuilder(seed=options.seed, **parameters).build()
+        result = measure(source_code)
+        peak = measure_memory(source_code)
+        print(f'{value:>12} {source_code.count(chr(10)):>8} {result["tokens"]:>8} {result["tokenize"]:>12.4f} {result["parse"]:>10.4f} {result["gen"]:>10.4f} {peak // 1024:>10} {result["instructions"]:>13}')
@@ -0,0 +1,255 @@
+from instructions import Instruction, Label, JUMPS
+from vm import COSTS
+
+
+# value numbering of accumulator and memory cells inside a basic block.
+# Value is ('const', n), or ('value', k) for anything known only by identity - same value numbers
+# mean same contents, so loads and recomputations of what accumulator already holds are redundant
+class Tracker:
+    def __init__(self, constants, first_cell):
+        self.first_cell = first_cell    # cells below it are temporary ones - used only directly, never through address
+        self.constants = {cell: ('const', value) for cell, value in constants.items()}  # cells that never change
+        self.expressions = dict()
+        self.count = 0
+        self.cells = dict()     # before first label constant cells are still being initialized
+        self.holders = dict()   # value -> cells holding it, in order they got it (constant cells aside)
+        self.memory = set()     # cells forget_memory drops
+        self.pool = dict()      # value -> constant cell holding it, once constants are initialized
+        self.pooled = dict()
+        for cell, value in self.constants.items():
+            self.pooled.setdefault(value, cell)
+        self.accumulator = self.fresh()
+
+    def fresh(self):
+        self.count += 1
+        return ('value', self.count)
+
+    # start of basic block - nothing is known except constants
+    def reset(self):
+        self.accumulator = self.fresh()
+        self.cells = dict(self.constants)
+        self.holders = dict()
+        self.memory = set()
+        self.pool = self.pooled
+
+    def store(self, cell, value):
+        if cell in self.cells:
+            self.holders.get(self.cells[cell], dict()).pop(cell, None)
+        if cell in self.constants and self.pool:
+            self.pool = {content: holder for content, holder in self.pool.items() if holder != cell}
+        self.cells[cell] = value
+        self.holders.setdefault(value, dict())[cell] = None
+        if cell >= self.first_cell and cell not in self.constants:
+            self.memory.add(cell)
+
+    # memory written through unknown address - every cell may be changed, except temporary and constant ones
+    def forget_memory(self):
+        for cell in self.memory:
+            del self.holders[self.cells.pop(cell)][cell]
+        self.memory = set()
+
+    def cell(self, address):
+        if address == 0:
+            return self.accumulator
+        if address not in self.cells:
+            self.store(address, self.fresh())
+        return self.cells[address]
+
+    def holder(self, value):
+        if value in self.pool:
+            return self.pool[value]
+        return next(iter(self.holders.get(value, ())), None)
+
+    def combine(self, opcode, a, b = None):
+        if opcode == 'HALF':
+            if a[0] == 'const':
+                return ('const', a[1] >> 1)
+            key = (opcode, a)
+        else:
+            if a[0] == 'const' and b[0] == 'const':
+                return ('const', a[1] + b[1] if opcode == 'ADD' else a[1] - b[1])
+            if b == ('const', 0):
+                return a
+            if opcode == 'ADD' and a == ('const', 0):
+                return b
+            if opcode == 'SUB' and a == b:
+                return ('const', 0)
+            key = (opcode, a, b) if opcode == 'SUB' else (opcode,) + tuple(sorted((a, b)))
+        if key not in self.expressions:
+            self.expressions[key] = self.fresh()
+        return self.expressions[key]
+
+    # address kept in cell (or accumulator for operand 0), if it is known
+    def address(self, operand):
+        value = self.cell(operand)
+        if value[0] == 'const' and value[1] > 0:
+            return value[1]
+        return None
+
+    # new value of accumulator: instruction is dropped when accumulator already holds it,
+    # and replaced by LOAD when some cell holds it for no more than instruction costs
+    def accumulate(self, instruction, value):
+        if value == self.accumulator:
+            return []
+        self.accumulator = value
+        if instruction.opcode != 'LOAD' and COSTS[instruction.opcode] >= COSTS['LOAD']:
+            cell = self.holder(value)
+            if cell is not None:
+                return [Instruction('LOAD', cell)]
+        return [instruction]
+
+    def step(self, instruction):
+        opcode, operand = instruction.opcode, instruction.operand
+
+        if opcode == 'LOAD':
+            return self.accumulate(instruction, self.cell(operand))
+
+        elif opcode == 'SET':
+            return self.accumulate(instruction, ('const', operand) if isinstance(operand, int) else self.fresh())
+
+        elif opcode == 'ADD' or opcode == 'SUB':
+            return self.accumulate(instruction, self.combine(opcode, self.accumulator, self.cell(operand)))
+
+        elif opcode == 'HALF':
+            return self.accumulate(instruction, self.combine(opcode, self.accumulator))
+
+        elif opcode == 'LOADI':
+            address = self.address(operand)
+            if address is None:
+                return self.accumulate(instruction, self.fresh())
+            return self.accumulate(Instruction('LOAD', address), self.cell(address))
+
+        elif opcode == 'ADDI' or opcode == 'SUBI':
+            address = self.address(operand)
+            direct = opcode[:3]
+            if address is None:
+                return self.accumulate(instruction, self.fresh())
+            return self.accumulate(Instruction(direct, address), self.combine(direct, self.accumulator, self.cell(address)))
+
+        elif opcode == 'STORE':
+            if operand == 0:
+                return [instruction]
+            if self.cells.get(operand) == self.accumulator:
+                return []
+            self.store(operand, self.accumulator)
+            return [instruction]
+
+        elif opcode == 'STOREI':
+            address = self.address(operand)
+            if address is None:
+                self.forget_memory()
+                return [instruction]
+            if self.cells.get(address) == self.accumulator:
+                return []
+            self.store(address, self.accumulator)
+            return [Instruction('STORE', address)]
+
+        elif opcode == 'GET':
+            if operand == 0:
+                self.accumulator = self.fresh()
+            else:
+                self.store(operand, self.fresh())
+            return [instruction]
+
+        elif opcode == 'JUMP' or opcode == 'RTRN' or opcode == 'HALT':
+            self.reset()
+            return [instruction]
+
+        else: # PUT, conditional jumps
+            return [instruction]
+
+
+# first_cell: first cell that isn't temporary one, constants: cell -> value for cells that keep the same value
+# after program start (constant pool)
+def track_values(code, first_cell, constants = {}):
+    tracker = Tracker(constants, first_cell)
+    optimized = []
+    for instruction in code:
+        if isinstance(instruction, Label):
+            tracker.reset()
+            optimized.append(instruction)
+        else:
+            optimized.extend(tracker.step(instruction))
+    return optimized
+
+
+READS = ('LOAD', 'ADD', 'SUB', 'LOADI', 'ADDI', 'SUBI', 'STOREI', 'PUT', 'RTRN')
+WRITES = ('STORE', 'GET')
+
+
+# removes STOREs to temporary cells which are never read afterwards (liveness over control flow graph of unit).
+# entries: label of other unit -> temporary cells it reads, returned: temporary cells read by code that RTRN returns
+# to - every temporary cell when they aren't known. Jump to other unit comes back (if ever) to return address SET
+# right before it (call), or to any address SET as return address
+def remove_dead_stores(code, first_cell, entries = {}, returned = None):
+    positions = dict()
+    for index, instruction in enumerate(code):
+        if isinstance(instruction, Label):
+            positions[instruction] = index
+    returns = [positions[instruction.operand] for instruction in code
+               if not isinstance(instruction, Label) and instruction.opcode == 'SET' and instruction.operand in positions]
+    calls = dict()  # jump to other unit -> position of its return address
+    address = None
+    for index, instruction in enumerate(code):
+        if isinstance(instruction, Label) or instruction.opcode in JUMPS and instruction.operand in positions:
+            address = None
+        elif instruction.opcode == 'SET':
+            address = positions.get(instruction.operand)
+        elif instruction.opcode in JUMPS and address is not None:
+            calls[index] = address
+
+    def temporary(operand):
+        return isinstance(operand, int) and 0 < operand < first_cell
+
+    def cells(cells):
+        return (1 << first_cell) - 2 if cells is None else sum(1 << cell for cell in cells)
+
+    live = [0] * (len(code) + 1)    # bit mask of temporary cells read later, before instruction
+    live_after = [0] * len(code)
+    returned = cells(returned)
+
+    def target(index, returning):
+        label = code[index].operand
+        if label in positions:
+            return live[positions[label]]
+        if index in calls:
+            returning = live[calls[index]]
+        return cells(entries.get(label)) | returning
+
+    changed = True
+    while changed:
+        changed = False
+        returning = 0
+        for index in returns:
+            returning |= live[index]
+        for index in range(len(code) - 1, -1, -1):
+            instruction = code[index]
+            if isinstance(instruction, Label):
+                after = live[index + 1]
+                before = after
+            else:
+                opcode, operand = instruction.opcode, instruction.operand
+                if opcode == 'JUMP':
+                    after = target(index, returning)
+                elif opcode in JUMPS:
+                    after = target(index, returning) | live[index + 1]
+                elif opcode == 'RTRN':
+                    after = returned
+                elif opcode == 'HALT':
+                    after = 0
+                else:
+                    after = live[index + 1]
+                before = after
+                if temporary(operand):
+                    if opcode in WRITES:
+                        before &= ~(1 << operand)
+                    if opcode in READS:
+                        before |= 1 << operand
+            live_after[index] = after
+            if before != live[index]:
+                live[index] = before
+                changed = True
+
+    return [instruction for index, instruction in enumerate(code)
+            if isinstance(instruction, Label) or instruction.opcode != 'STORE'
+            or not temporary(instruction.operand) or live_after[index] >> instruction.operand & 1]
@@ -0,0 +1,376 @@
+import re
+import sys
+
+from instructions import Instruction
+
+# opcodes in the same order as maszyna_wirtualna/instructions.hh
+GET, PUT, LOAD, STORE, LOADI, STOREI, ADD, SUB, ADDI, SUBI, SET, HALF, JUMP, JPOS, JZERO, JNEG, RTRN, HALT = range(18)
+
+OPCODES = {
+    'GET': GET, 'PUT': PUT, 'LOAD': LOAD, 'STORE': STORE, 'LOADI': LOADI, 'STOREI': STOREI,
+    'ADD': ADD, 'SUB': SUB, 'ADDI': ADDI, 'SUBI': SUBI, 'SET': SET, 'HALF': HALF,
+    'JUMP': JUMP, 'JPOS': JPOS, 'JZERO': JZERO, 'JNEG': JNEG, 'RTRN': RTRN, 'HALT': HALT,
+}
+
+# cost of every instruction, exactly as charged by run_machine in maszyna_wirtualna/mw.cc
+COSTS = {
+    'GET': 100, 'PUT': 100,
+    'LOAD': 10, 'STORE': 10, 'LOADI': 20, 'STOREI': 20,
+    'ADD': 10, 'SUB': 10, 'ADDI': 20, 'SUBI': 12,
+    'SET': 50, 'HALF': 5,
+    'JUMP': 1, 'JPOS': 1, 'JZERO': 1, 'JNEG': 1,
+    'RTRN': 10, 'HALT': 0,
+}
+
+NO_OPERAND = {'HALF', 'HALT'}
+JUMPS = {'JUMP', 'JPOS', 'JZERO', 'JNEG'}
+
+# internal opcodes produced by predecode - operand 0 is the accumulator itself,
+# so these forms never touch the memory array
+_ACC_LOAD, _ACC_ADD, _ACC_SUB, _ACC_LOADI, _ACC_STOREI, _ACC_ADDI, _ACC_SUBI, _ACC_GET, _ACC_RTRN = range(18, 27)
+_FAR = 27       # static operand outside of dense memory
+_BAD = 28       # negative static address - error raised only when executed
+_END = 29       # sentinel past the last instruction
+
+DENSE_LIMIT = 1 << 20   # cells below are kept in a list, everything else goes to a dict
+
+_TOKEN = re.compile(r'#[^\n]*|([A-Z]+)|(-?\d+)|(\S)')
+
+
+def parse(text):
+    program = []
+    pending = None
+    for match in _TOKEN.finditer(text):
+        name, number, junk = match.groups()
+        if junk is not None:
+            raise Exception(f"unrecognized symbol '{junk}' in machine code")
+        if name is not None:
+            if pending is not None:
+                raise Exception(f"instruction '{pending}' expects an operand")
+            if name not in OPCODES:
+                raise Exception(f"unknown instruction '{name}'")
+            if name in NO_OPERAND:
+                program.append((name, None))
+            else:
+                pending = name
+        elif number is not None:
+            if pending is None:
+                raise Exception(f"unexpected number '{number}' in machine code")
+            program.append((pending, int(number)))
+            pending = None
+    if pending is not None:
+        raise Exception(f"instruction '{pending}' expects an operand")
+    return program
+
+
+def predecode(program):
+    size = len(program)
+    ops = []
+    args = []
+    top = 0
+    for lr, instruction in enumerate(program):
+        if isinstance(instruction, Instruction):
+            name, operand = instruction.opcode, instruction.operand
+        else:
+            name, operand = instruction
+        op = OPCODES[name]
+        if name in JUMPS:
+            target = lr + operand
+            if not 0 <= target < size:
+                target = size   # lands on the sentinel which reports the error
+            ops.append(op)
+            args.append(target)
+            continue
+        if name in NO_OPERAND or op == SET:
+            ops.append(op)
+            args.append(operand)
+            continue
+        if operand < 0:
+            ops.append(_BAD)
+            args.append((op, operand))
+            continue
+        if operand >= DENSE_LIMIT:
+            ops.append(_FAR)
+            args.append((op, operand))
+            continue
+        if operand == 0:
+            if op in (STORE, PUT):
+                pass
+            elif op == LOAD:
+                op = _ACC_LOAD
+            elif op == ADD:
+                op = _ACC_ADD
+            elif op == SUB:
+                op = _ACC_SUB
+            elif op == LOADI:
+                op = _ACC_LOADI
+            elif op == STOREI:
+                op = _ACC_STOREI
+            elif op == ADDI:
+                op = _ACC_ADDI
+            elif op == SUBI:
+                op = _ACC_SUBI
+            elif op == GET:
+                op = _ACC_GET
+            elif op == RTRN:
+                op = _ACC_RTRN
+        top = max(top, operand)
+        ops.append(op)
+        args.append(operand)
+    ops.append(_END)
+    args.append(None)
+    return ops, args, top
+
+
+class Result:
+    def __init__(self, outputs, cost, io, steps):
+        self.outputs = outputs
+        self.cost = cost
+        self.io = io
+        self.steps = steps
+
+    def __repr__(self):
+        return f'Outputs: {self.outputs}, Cost: {self.cost}, I/O: {self.io}, Steps: {self.steps}'
+
+
+def run(program, inputs=(), write=None, limit=None):
+    if isinstance(program, str):
+        program = parse(program)
+    ops, args, top = predecode(program)
+    size = len(program)
+    inputs = iter(inputs)
+    outputs = []
+
+    memory = [0] * (top + 1)
+    dense = len(memory)
+    sparse = {}
+
+    def read(address):
+        if 0 < address < dense:
+            return memory[address]
+        return sparse.get(address, 0)
+
+    def write_cell(address, value):
+        nonlocal dense
+        if 0 <= address < DENSE_LIMIT:
+            if address >= dense:
+                memory.extend([0] * (max(address + 1, 2 * dense) - dense))
+                dense = len(memory)
+            memory[address] = value
+        else:
+            sparse[address] = value
+
+    def get():
+        try:
+            return int(next(inputs))
+        except StopIteration:
+            raise Exception('no more input for GET instruction')
+
+    def put(value):
+        outputs.append(value)
+        if write is not None:
+            write(value)
+
+    acc = 0
+    lr = 0
+    t = 0
+    io = 0
+    steps = 0
+    while True:
+        op = ops[lr]
+        x = args[lr]
+        steps += 1
+        if op == LOAD:
+            acc = memory[x]
+            t += 10
+            lr += 1
+        elif op == STORE:
+            memory[x] = acc
+            t += 10
+            lr += 1
+        elif op == ADD:
+            acc += memory[x]
+            t += 10
+            lr += 1
+        elif op == SUB:
+            acc -= memory[x]
+            t += 10
+            lr += 1
+        elif op == JPOS:
+            t += 1
+            if acc > 0:
+                if x <= lr and limit is not None and t > limit:
+                    raise Exception(f'cost limit {limit} exceeded')
+                lr = x
+            else:
+                lr += 1
+        elif op == JZERO:
+            t += 1
+            if acc == 0:
+                if x <= lr and limit is not None and t > limit:
+                    raise Exception(f'cost limit {limit} exceeded')
+                lr = x
+            else:
+                lr += 1
+        elif op == JUMP:
+            t += 1
+            if x <= lr and limit is not None and t > limit:
+                raise Exception(f'cost limit {limit} exceeded')
+            lr = x
+        elif op == JNEG:
+            t += 1
+            if acc < 0:
+                if x <= lr and limit is not None and t > limit:
+                    raise Exception(f'cost limit {limit} exceeded')
+                lr = x
+            else:
+                lr += 1
+        elif op == SET:
+            acc = x
+            t += 50
+            lr += 1
+        elif op == HALF:
+            acc >>= 1
+            t += 5
+            lr += 1
+        elif op == _ACC_LOADI:
+            acc = read(acc) if acc else acc
+            t += 20
+            lr += 1
+        elif op == LOADI:
+            a = memory[x]
+            if 0 < a < dense:
+                acc = memory[a]
+            elif a != 0:
+                acc = sparse.get(a, 0)
+            t += 20
+            lr += 1
+        elif op == STOREI:
+            a = memory[x]
+            if 0 < a < dense:
+                memory[a] = acc
+            elif a != 0:
+                write_cell(a, acc)
+            t += 20
+            lr += 1
+        elif op == _ACC_ADD:
+            acc += acc
+            t += 10
+            lr += 1
+        elif op == ADDI:
+            a = memory[x]
+            acc += read(a) if a else acc
+            t += 20
+            lr += 1
+        elif op == SUBI:
+            a = memory[x]
+            acc -= read(a) if a else acc
+            t += 12
+            lr += 1
+        elif op == _ACC_STOREI:
+            if acc:
+                write_cell(acc, acc)
+            t += 20
+            lr += 1
+        elif op == GET:
+            memory[x] = get()
+            t += 100
+            io += 100
+            lr += 1
+        elif op == PUT:
+            put(memory[x] if x else acc)
+            t += 100
+            io += 100
+            lr += 1
+        elif op == RTRN or op == _ACC_RTRN:
+            lr = memory[x] if op == RTRN else acc
+            t += 10
+            if not 0 <= lr < size:
+                raise Exception(f'call of nonexistent instruction {lr}')
+        elif op == HALT:
+            steps -= 1
+            break
+        elif op == _ACC_LOAD:
+            t += 10
+            lr += 1
+        elif op == _ACC_SUB:
+            acc = 0
+            t += 10
+            lr += 1
+        elif op == _ACC_ADDI:
+            acc += read(acc) if acc else acc
+            t += 20
+            lr += 1
+        elif op == _ACC_SUBI:
+            acc -= read(acc) if acc else acc
+            t += 12
+            lr += 1
+        elif op == _ACC_GET:
+            acc = get()
+            t += 100
+            io += 100
+            lr += 1
+        elif op == _FAR:
+            op, x = x
+            if op == LOAD:
+                acc = read(x)
+            elif op == STORE:
+                write_cell(x, acc)
+            elif op == ADD:
+                acc += read(x)
+            elif op == SUB:
+                acc -= read(x)
+            elif op == LOADI:
+                acc = read(read(x)) if read(x) else acc
+            elif op == STOREI:
+                if read(x):
+                    write_cell(read(x), acc)
+            elif op == ADDI:
+                acc += read(read(x)) if read(x) else acc
+            elif op == SUBI:
+                acc -= read(read(x)) if read(x) else acc
+            elif op == GET:
+                write_cell(x, get())
+                io += 100
+            elif op == PUT:
+                put(read(x))
+                io += 100
+            elif op == RTRN:
+                t += 10
+                lr = read(x)
+                if not 0 <= lr < size:
+                    raise Exception(f'call of nonexistent instruction {lr}')
+                continue
+            t += COSTS[_NAMES[op]]
+            lr += 1
+        elif op == _BAD:
+            raise Exception(f'negative memory address in instruction {lr}: {_NAMES[x[0]]} {x[1]}')
+        else: # op == _END
+            raise Exception(f'call of nonexistent instruction {lr}')
+
+    return Result(outputs, t, io, steps)
+
+
+_NAMES = {op: name for name, op in OPCODES.items()}
+
+
+def read_numbers(stream):
+    for line in stream:
+        for token in line.split():
+            yield int(token)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(f'Usage: python vm.py <compiled_program>')
+        exit(1)
+
+    with open(sys.argv[1], 'r') as program_file:
+        program = parse(program_file.read())
+
+    try:
+        result = run(program, read_numbers(sys.stdin), write=lambda value: print(f'> {value}'))
+    except Exception as e:
+        print(f'Error: {e}', file=sys.stderr)
+        exit(1)
+    print(f'Finished program (cost: {result.cost}; i/o: {result.io})')